@@ -1,169 +1,660 @@
-import pandas as pd
 from collection import Collection
 from displacement import Displacement
+from element import K_cache, M_cache, T_cache, get_K_batch, get_M_batch, get_T_batch, get_condensation_batch, \
+    get_geometric_K_batch, get_global_K_batch, get_joint_T_batch, get_local_displacement_batch, global_K_cache, joint_T_cache
+from load_case import LoadCase, LoadCombination
+from mechanism import UnstableStructureError, find_mechanisms
+from model import Model, from_collections, get_rigidity_matrices
 import numpy as np
-import rref
+from parallel import CHUNK_SIZE, map_chunks
+from profiler import Profiler
+from results import Influence, Modes, Results
+import scipy.sparse as sp
+import time
+from solver import LowRankUpdateSolver, SingularMatrixError, get_solver
+
+SPARSE_THRESHOLD = 600
+# Largest number of modified free displacements updated through a low-rank update instead of a new factorization
+LOW_RANK_UPDATE_LIMIT = 120
+UNIT_LOAD = [0, 0, -1, 0, 0, 0]
+P_DELTA_TOLERANCE = 1e-8
+P_DELTA_MAX_ITERATIONS = 50
+# Matrices whose sizes are reported by the profiler after each stage
+STAGE_MATRICES = {
+    'generate_displacements': ['displacement_ids'],
+    'transform_global_to_element_local': ['element_dofs', 'T'],
+    'generate_stiffness_matrix': ['element_K', 'K'],
+    'update_stiffness_matrix': ['K'],
+    'generate_partitioning_matrices': ['f', 's'],
+    'generate_forces_matrix': ['P'],
+    'calculate_displacements': ['D'],
+    'calculate_element_displacements': ['element_D'],
+    'calculate_element_forces': ['element_P'],
+    'generate_mass_matrix': ['element_M', 'M'],
+    'calculate_modes': ['mode_shapes'],
+    'calculate_influence': ['influence_D', 'influence_P'],
+    'calculate_p_delta': ['D', 'element_P'],
+}
 
 
 class Analyzer:
-    def __init__(self, nodes: list, elements: list):
+    def __init__(self,
+                 nodes: list = None,
+                 elements: list = None,
+                 sparse: bool = None,
+                 solver='auto',
+                 load_cases: list = None,
+                 incremental: bool = False,
+                 renumber: bool = False,
+                 condense_releases: bool = False,
+                 model: Model = None,
+                 verbose: bool = True,
+                 executor=None,
+                 workers: int = None,
+                 chunk_size: int = CHUNK_SIZE,
+                 profile=False):
         self.nodes = nodes
         self.elements = elements
+        self.model = model
+        self.node_load_case = load_cases is None
+        self.load_cases = load_cases
+        self.sparse = sparse
+        self.solver = solver
+        self.incremental = incremental
+        self.renumber = renumber
+        self.condense_releases = condense_releases
+        self.verbose = verbose
+        self.executor = executor
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.profiler = Profiler() if profile is True else profile or None
+        self.profile_report = None
+        self.renumbering_report = None
+        self.topology = None
+        self.factored_Kff = None
 
     def analyze(self):
-        self.generate_displacements()
-        self.transform_global_to_element_local()
-        self.generate_stiffness_matrix()
-        self.generate_partitioning_matrices()
-        self.generate_forces_matrix()
-        self.calculate_displacements()
-        self.calculate_element_displacements()
-        self.calculate_element_forces()
-        self.print_results()
+        self.run_profiled(self.run_analysis)
+
+    def run_analysis(self):
+        self.run_stiffness_stages()
+        self.run_stage('generate_forces_matrix')
+        self.run_stage('calculate_displacements')
+        self.run_stage('calculate_element_displacements')
+        self.run_stage('calculate_element_forces')
+        if self.verbose:
+            self.run_stage('print_results')
+
+    # Finds the count lowest natural modes (those closest to the shift sigma) of the free displacements from the
+    # consistent or lumped mass matrix, which needs the density of the Materials.
+    def analyze_modes(self, count: int = 10, lumped: bool = False, sigma: float = 0):
+        self.run_profiled(lambda: self.run_modal_analysis(count, lumped, sigma))
+        return self.modes
+
+    def run_modal_analysis(self, count: int, lumped: bool, sigma: float):
+        self.run_stage('generate_model')
+        self.run_stage('generate_displacements')
+        self.run_stage('transform_global_to_element_local')
+        self.run_stage('generate_stiffness_matrix')
+        self.run_stage('generate_partitioning_matrices')
+        self.run_stage('generate_mass_matrix', lumped)
+        self.run_stage('calculate_modes', count, sigma)
+
+    # Second-order (P-Delta) analysis of each load case: the geometric stiffness of the Elements under their axial forces
+    # is added to K, and the equilibrium is found by modified Newton iterations. The tangent stiffness is factorized at
+    # the first iteration and then every tangent_interval iterations (never again if 0).
+    def analyze_p_delta(self, tolerance: float = P_DELTA_TOLERANCE, max_iterations: int = P_DELTA_MAX_ITERATIONS,
+                        tangent_interval: int = 0):
+        self.run_profiled(lambda: self.run_p_delta_analysis(tolerance, max_iterations, tangent_interval))
+
+    def run_p_delta_analysis(self, tolerance: float, max_iterations: int, tangent_interval: int):
+        self.run_stiffness_stages()
+        self.run_stage('generate_forces_matrix')
+        self.run_stage('calculate_displacements')
+        self.run_stage('calculate_element_displacements')
+        self.run_stage('calculate_element_forces')
+        self.run_stage('calculate_p_delta', tolerance, max_iterations, tangent_interval)
+        self.run_stage('calculate_element_displacements')
+        if self.verbose:
+            self.run_stage('print_results')
+
+    # Moves the load (a unit load downwards by default) over the Nodes and returns the displacements and the forces of
+    # the Elements (all of them by default) for each position, all solved against a single factorization.
+    def analyze_influence(self, nodes: list, load=UNIT_LOAD, elements: list = None):
+        self.run_profiled(lambda: self.run_influence_analysis(nodes, load, elements))
+        return self.influence
+
+    def run_influence_analysis(self, nodes: list, load, elements: list):
+        self.run_stiffness_stages()
+        self.run_stage('calculate_influence', nodes, load, elements)
+
+    def run_stiffness_stages(self):
+        self.run_stage('generate_model')
+        if not (self.incremental and self.run_stage('update_stiffness_matrix')):
+            self.run_stage('generate_displacements')
+            self.run_stage('transform_global_to_element_local')
+            self.run_stage('generate_stiffness_matrix')
+            self.run_stage('generate_partitioning_matrices')
+
+    def run_profiled(self, function):
+        if self.profiler is not None:
+            self.profiler.start()
+        try:
+            function()
+        finally:
+            if self.profiler is not None:
+                self.profiler.stop()
+                self.profile_report = self.profiler.get_report()
+
+    def run_stage(self, name: str, *arguments):
+        if self.profiler is None:
+            return getattr(self, name)(*arguments)
+        return self.profiler.run(name, lambda: getattr(self, name)(*arguments), lambda: {
+            matrix: getattr(self, matrix) for matrix in STAGE_MATRICES.get(name, []) if hasattr(self, matrix)
+        })
+
+    # The analysis runs on the arrays of a Model, which is rebuilt from the Nodes and Elements, if given, on every run.
+    def generate_model(self):
+        if self.nodes is not None:
+            self.model = from_collections(self.nodes, self.elements)
 
     def generate_displacements(self):
-        displacements = []
-        self.displacement_map = {'nodes': np.zeros([len(self.nodes), 6]), 'elements': np.zeros([len(self.elements), 12])}
-        for node in self.nodes:
-            i = node.id
-            for j in range(0, 6):
-                self.displacement_map['nodes'][i][j] = len(displacements)
-                displacements.append(Displacement('node', i, j, node.rigidity_matrix[j] == 1))
-        for element in self.elements:
-            i = element.id
-            for j in range(0, 12):
-                if element.rigidity_matrix[j] == 1:
-                    self.displacement_map['elements'][i][j] = -1
-                else:
-                    self.displacement_map['elements'][i][j] = len(displacements)
-                    displacements.append(Displacement('element', i, j, False))
-        self.displacements = Collection(displacements).list
+        self.condense_element_releases()
+        node_count = self.model.get_node_count()
+        released = (self.model.get_element_rigidity_matrices() != 1) & ~self.condensed[:, np.newaxis]
+        element_ids, local_ids = np.nonzero(released)
+        self.displacement_map = {
+            'nodes': np.arange(0, 6 * node_count).reshape([node_count, 6]),
+            'elements': -np.ones(released.shape, dtype=int)
+        }
+        self.displacement_map['elements'][released] = 6 * node_count + np.arange(0, len(element_ids))
+        # [object type (0 for nodes, 1 for elements), object id, local displacement id] of each displacement
+        self.displacement_ids = np.concatenate([
+            np.column_stack([
+                np.zeros(6 * node_count, dtype=int),
+                np.repeat(np.arange(0, node_count), 6),
+                np.tile(np.arange(0, 6), node_count)
+            ]),
+            np.column_stack([np.ones(len(element_ids), dtype=int), element_ids, local_ids])
+        ])
+        self.supported = np.concatenate([
+            self.model.get_node_rigidity_matrices().ravel() == 1,
+            np.zeros(len(element_ids), dtype=bool)
+        ])
+        self._displacements = None
+        self.displacement_order = np.arange(0, len(self.supported))
+        if self.renumber:
+            self.renumber_displacements()
+
+    # Displacement objects are only built when they are needed to label the results.
+    @property
+    def displacements(self):
+        if self._displacements is None:
+            object_types = ['node', 'element']
+            self._displacements = Collection([
+                Displacement(object_types[ids[0]], ids[1], ids[2], supported)
+                for ids, supported in zip(self.displacement_ids.tolist(), self.supported.tolist())
+            ]).list
+        return self._displacements
+
+    def get_displacement_count(self):
+        return len(self.supported)
+
+    def get_element_dofs(self):
+        node_dofs = self.displacement_map['nodes'][self.model.connectivity].reshape([-1, 12])
+        return np.concatenate([node_dofs, self.displacement_map['elements']], axis=1)
+
+    def get_stiffness_pattern(self, element_dofs):
+        n = self.get_displacement_count()
+        rows = np.repeat(element_dofs[:, :, np.newaxis], 24, axis=2)
+        columns = np.repeat(element_dofs[:, np.newaxis, :], 24, axis=1)
+        used = (rows >= 0) & (columns >= 0)
+        pattern = sp.coo_matrix((np.ones(np.count_nonzero(used)), (rows[used], columns[used])), shape=(n, n))
+        return (pattern + sp.eye(n)).tocsr()
+
+    def get_bandwidth_and_profile(self, pattern):
+        pattern = sp.tril(pattern).tocsr()
+        if pattern.nnz == 0:
+            return 0, 0
+        rows = np.repeat(np.arange(0, pattern.shape[0]), np.diff(pattern.indptr))
+        widths = rows - pattern.indices
+        first_columns = np.minimum.reduceat(pattern.indices, pattern.indptr[:-1])
+        return int(widths.max()), int(np.sum(np.arange(0, pattern.shape[0]) - first_columns))
 
+    # Renumbers the displacements by the Reverse Cuthill-McKee ordering of their connectivity to reduce the bandwidth
+    # and profile of K. displacement_order keeps the new ids in the original order, which the results are returned in.
+    def renumber_displacements(self):
+        from scipy.sparse.csgraph import reverse_cuthill_mckee
+        pattern = self.get_stiffness_pattern(self.get_element_dofs())
+        before = self.get_bandwidth_and_profile(pattern)
+        permutation = reverse_cuthill_mckee(pattern, symmetric_mode=True)
+        new_ids = np.empty(len(permutation), dtype=int)
+        new_ids[permutation] = np.arange(0, len(permutation))
+        after = self.get_bandwidth_and_profile(pattern[permutation][:, permutation])
+        for map in [self.displacement_map['nodes'], self.displacement_map['elements']]:
+            map[map >= 0] = new_ids[map[map >= 0]]
+        self.displacement_ids = self.displacement_ids[permutation]
+        self.supported = self.supported[permutation]
+        self.displacement_order = new_ids
+        self.renumbering_report = {'bandwidth': [before[0], after[0]], 'profile': [before[1], after[1]]}
+
+    # Each element is described by 24 global DOFs (6 per node, then its 12 release DOFs, -1 where not released) and a
+    # 12x24 block mapping them onto its local DOFs: the rotation for joined DOFs and the identity for released ones.
     def transform_global_to_element_local(self):
-        self.T = []
-        for element in self.elements:
-            i = element.id
-            element_T = element.get_T()
-            T = np.zeros([12, len(self.displacements)])
-            for j in range(0, 12):
-                displacement_id = int(self.displacement_map['elements'][i][j])
-                if displacement_id >= 0:
-                    T[j][displacement_id] = 1
-                else:
-                    member_end = j // 6
-                    node = element.get_nodes()[member_end]
-                    node_map = self.displacement_map['nodes'][node.id]
-                    for k in range(0, 6):
-                        displacement_id = int(node_map[k])
-                        T[j][displacement_id] += element_T[j][6 * member_end + k]
-            self.T.append(T)
+        self.element_dofs = self.get_element_dofs()
+        self.T = self.get_element_T(np.arange(0, self.model.get_element_count()))
+
+    # The element matrices are fetched from the shared caches by the values they depend on, so that elements with the
+    # same properties share them, and only the missing ones are calculated.
+    def get_element_T(self, elements):
+        cosine_matrices = self.model.get_cosine_matrices(elements).reshape([-1, 9])
+        rotation = T_cache.get_array_batch(
+            cosine_matrices,
+            lambda i: self.map_elements(get_T_batch, [cosine_matrices[i]])
+        )
+        rigidity = self.model.element_rigidity[elements]
+        return joint_T_cache.get_array_batch(
+            np.column_stack([cosine_matrices, rigidity]),
+            lambda i: self.map_elements(get_joint_T_batch, [rotation[i], get_rigidity_matrices(rigidity[i], 12)])
+        )
+
+    def get_element_local_K(self, elements):
+        properties = self.model.get_element_properties(elements)
+        return K_cache.get_array_batch(properties, lambda i: self.map_elements(get_K_batch, list(properties[i].T)))
+
+    def get_element_K(self, elements, T, local_K, condensed):
+        return global_K_cache.get_array_batch(
+            self.get_element_K_keys(elements, condensed),
+            lambda i: self.map_elements(get_global_K_batch, [local_K[i], T[i]])
+        )
+
+    # Runs a batch function on chunks of elements through the executor, if any. The chunks are merged in order, so the
+    # result does not depend on the executor.
+    def map_elements(self, function, arguments: list):
+        return map_chunks(function, arguments, self.executor, self.workers, self.chunk_size)
+
+    # [L, A, I2, I3, J, E, G, cosine matrix, rigidity, condensed] of each element
+    def get_element_K_keys(self, elements, condensed):
+        return np.column_stack([
+            self.model.get_element_properties(elements),
+            self.model.get_cosine_matrices(elements).reshape([-1, 9]),
+            self.model.element_rigidity[elements],
+            condensed
+        ])
+
+    def get_condensation(self, elements, local_K):
+        if not self.condense_releases:
+            return np.zeros(len(local_K), dtype=bool), local_K, None
+        rigidity_matrices = get_rigidity_matrices(self.model.element_rigidity[elements], 12)
+        condensed_K, recovery, condensable = self.map_elements(get_condensation_batch, [local_K, rigidity_matrices])
+        condensed = condensable & np.any(rigidity_matrices != 1, axis=1)
+        return condensed, condensed_K, recovery
+
+    # Released DOFs of the condensed elements are not global displacements. Their stiffness is condensed into the joined
+    # DOFs, and element_recovery recovers them from the joined displacements. Without condensation there is no
+    # element_recovery, and it is only used where some element is condensed.
+    def condense_element_releases(self):
+        elements = np.arange(0, self.model.get_element_count())
+        self.element_local_K = self.get_element_local_K(elements)
+        self.condensed, self.element_condensed_K, self.element_recovery = self.get_condensation(
+            elements, self.element_local_K
+        )
+
+    def is_sparse(self):
+        if self.sparse is None:
+            return self.get_displacement_count() >= SPARSE_THRESHOLD
+        return self.sparse
 
     def generate_stiffness_matrix(self):
-        self.element_K = []
-        self.K = np.zeros([len(self.displacements), len(self.displacements)])
-        for element in self.elements:
-            i = element.id
-            T = self.T[i]
-            element_K = element.get_K()
-            K = self.quad(T, element_K, T)
-            self.element_K.append(K)
-            self.K += K
+        elements = np.arange(0, self.model.get_element_count())
+        self.element_K = self.get_element_K(elements, self.T, self.element_condensed_K, self.condensed)
+        self.K = self.assemble(self.element_K, self.element_dofs)
+        self.element_K_keys = self.get_element_K_keys(elements, self.condensed)
+        self.topology = self.get_topology()
+        self.factored_Kff = None
+        self.modified_dofs = np.zeros(0, dtype=int)
+
+    # Element mass matrices are transformed like the stiffness matrices, with the released displacements of the
+    # condensed elements recovered from the joined ones.
+    def generate_mass_matrix(self, lumped: bool = False):
+        elements = np.arange(0, self.model.get_element_count())
+        properties = self.model.get_element_properties(elements)
+        keys = np.column_stack([
+            properties[:, [0, 1, 4]],
+            self.model.get_element_densities(elements),
+            np.full(len(elements), lumped)
+        ])
+        local_M = M_cache.get_array_batch(keys, lambda i: self.map_elements(get_M_batch, list(keys[i].T)))
+        T = self.T
+        if np.any(self.condensed):
+            T = T + self.element_recovery @ T
+        self.element_M = self.map_elements(get_global_K_batch, [local_M, T])
+        self.M = self.assemble(self.element_M, self.element_dofs)
+
+    def calculate_modes(self, count: int = 10, sigma: float = 0):
+        import scipy.sparse.linalg as spla
+        Kff = self.partition(self.K, self.f, self.f)
+        Mff = self.partition(self.M, self.f, self.f)
+        if not np.any(Mff.diagonal() > 0):
+            raise Exception('The mass matrix is zero. The density of the Materials must be set.')
+        # Shift-invert: the eigenvalues closest to sigma are found from solutions with the factorized Kff - sigma * Mff.
+        # Kff is factorized by the solver of the Analyzer, while an indefinite Kff - sigma * Mff is left to eigsh.
+        n = len(self.f)
+        operator = None
+        if sigma == 0:
+            solver = self.create_solver()
+            try:
+                solver.factorize(Kff)
+            except SingularMatrixError:
+                self.inv_test(Kff)
+            operator = spla.LinearOperator(
+                (n, n), matvec=lambda b: np.asarray(solver.solve_matrix(b)).reshape(b.shape), dtype=float
+            )
+        try:
+            eigenvalues, shapes = spla.eigsh(Kff, min(count, n - 1), M=Mff, sigma=sigma, OPinv=operator)
+        except SingularMatrixError as error:
+            self.inv_test(Kff, error)
+        order = np.argsort(eigenvalues)
+        mode_shapes = np.zeros([self.get_displacement_count(), len(order)])
+        mode_shapes[self.f] = shapes[:, order]
+        self.mode_shapes = mode_shapes
+        self.modes = Modes(
+            eigenvalues[order],
+            mode_shapes[self.displacement_order],
+            self.displacement_ids[self.displacement_order]
+        )
 
+    def assemble(self, element_K, element_dofs):
+        rows = np.repeat(element_dofs[:, :, np.newaxis], 24, axis=2)
+        columns = np.repeat(element_dofs[:, np.newaxis, :], 24, axis=1)
+        used = (rows >= 0) & (columns >= 0)
+        rows = rows[used]
+        columns = columns[used]
+        values = element_K[used]
+        n = self.get_displacement_count()
+        if self.is_sparse():
+            return sp.coo_matrix((values, (rows, columns)), shape=(n, n)).tocsr()
+        K = np.zeros([n, n])
+        np.add.at(K, (rows, columns), values)
+        return K
+
+    def get_topology(self):
+        return [self.model.node_rigidity.copy(), self.model.connectivity.copy(), self.model.element_rigidity.copy()]
+
+    # Patches the contributions of the elements changed since the last analysis into K, keeping the DOF numbering.
+    # Returns False when the supports, releases or connectivity have changed, which needs a new analysis.
+    def update_stiffness_matrix(self):
+        topology = self.get_topology()
+        if self.topology is None or not all(
+                np.array_equal(topology[i], self.topology[i]) for i in range(0, len(topology))):
+            return False
+        keys = self.get_element_K_keys(np.arange(0, self.model.get_element_count()), self.condensed)
+        changed = np.flatnonzero(np.any(keys != self.element_K_keys, axis=1))
+        if len(changed) == 0:
+            return True
+        local_K = self.get_element_local_K(changed)
+        condensed, condensed_K, recovery = self.get_condensation(changed, local_K)
+        if np.any(condensed != self.condensed[changed]):
+            return False
+        self.element_K_keys = keys
+        self.element_local_K[changed] = local_K
+        self.element_condensed_K[changed] = condensed_K
+        if self.condense_releases:
+            self.element_recovery[changed] = recovery
+        self.T[changed] = self.get_element_T(changed)
+        K = self.get_element_K(changed, self.T[changed], condensed_K, condensed)
+        self.K = self.K + self.assemble(K - self.element_K[changed], self.element_dofs[changed])
+        self.element_K[changed] = K
+        dofs = self.element_dofs[changed]
+        self.modified_dofs = np.union1d(self.modified_dofs, dofs[dofs >= 0])
+        return True
+
+    def gather(self, A, elements=slice(None)):
+        # Index -1 of the padded array is a zero row, so unused element DOFs gather zeros.
+        A = np.vstack([A, np.zeros([1, A.shape[1]])])
+        return A[self.element_dofs[elements]]
+
+    # Without load cases, the forces of the Model make up a single load case.
     def generate_forces_matrix(self):
-        P = np.zeros([len(self.displacements), 1])
-        for node in self.nodes:
-            i = node.id
-            node_map = self.displacement_map['nodes'][i]
-            for j in range(0, 6):
-                displacement_id = int(node_map[j])
-                P[displacement_id][0] = node.force[j]
+        if self.node_load_case:
+            self.load_cases = Collection([LoadCase('default', [])]).list
+        P = np.zeros([self.get_displacement_count(), len(self.load_cases)])
+        if self.node_load_case:
+            P[self.displacement_map['nodes'].ravel(), 0] = self.model.forces.ravel()
+        for load_case in self.load_cases:
+            for node, force in load_case.forces:
+                node_id = node if isinstance(node, (int, np.integer)) else node.id
+                P[self.displacement_map['nodes'][node_id], load_case.id] += force
         self.P = P
 
     def generate_partitioning_matrices(self):
-        f = []
-        s = []
-        for displacement in self.displacements:
-            i = displacement.id
-            if displacement.supported:
-                s.append(i)
-            else:
-                f.append(i)
-        self.f = np.array([[1 * (i == f[j]) for j in range(0, len(f))] for i in range(0, len(self.displacements))])
-        self.s = np.array([[1 * (i == s[j]) for j in range(0, len(s))] for i in range(0, len(self.displacements))])
+        self.f = np.flatnonzero(~self.supported)
+        self.s = np.flatnonzero(self.supported)
+
+    def partition(self, A, rows, columns):
+        if sp.issparse(A):
+            return A[rows][:, columns]
+        return A[np.ix_(rows, columns)]
 
     def calculate_displacements(self):
-        Pf = np.transpose(self.f) @ self.P
-        Kff = self.quad(self.f, self.K, self.f)
-        Kfs = self.quad(self.f, self.K, self.s)
-        Ksf = self.quad(self.s, self.K, self.f)
-        Kss = self.quad(self.s, self.K, self.s)
-        Ds = np.zeros([len(self.s[0]), 1])
-        if np.linalg.matrix_rank(Kff) != len(Kff):
-            self.inv_test(Kff)
+        Pf = self.P[self.f]
+        Kff = self.partition(self.K, self.f, self.f)
+        Kfs = self.partition(self.K, self.f, self.s)
+        Ksf = self.partition(self.K, self.s, self.f)
+        Kss = self.partition(self.K, self.s, self.s)
+        Ds = np.zeros([len(self.s), len(self.load_cases)])
+        self.linear_solver = self.factorize(Kff)
         # Pf = Kff * Df + Kfs * Ds
         # Df = Kff^(-1) * (Pf - Kfs * Ds)
-        invKff = np.linalg.inv(Kff)
-        Df = invKff @ (Pf - Kfs @ Ds)
+        Df = self.solve(self.linear_solver, Kff, Pf - Kfs @ Ds)
+        self.solver_report = self.linear_solver.get_report()
         # Ps = Ksf * Df + Kss * Ds
         Ps = Ksf @ Df + Kss @ Ds
-        self.D = self.zero(self.f @ Df + self.s @ Ds)
-        self.P = self.zero(self.K @ self.D)
+        D = np.zeros([self.get_displacement_count(), len(self.load_cases)])
+        D[self.f] = Df
+        D[self.s] = Ds
+        self.D = D
+        self.P = self.K @ D
+
+    def factorize(self, Kff):
+        if self.incremental and self.factored_Kff is not None:
+            free_index = -np.ones(self.get_displacement_count(), dtype=int)
+            free_index[self.f] = np.arange(0, len(self.f))
+            modified = free_index[self.modified_dofs]
+            modified = modified[modified >= 0]
+            # Kff is unchanged, e.g. when only the loads have been edited.
+            if len(modified) == 0:
+                return self.base_solver
+            if len(modified) <= min(LOW_RANK_UPDATE_LIMIT, len(self.f) // 4):
+                C = self.partition(Kff, modified, modified) - self.partition(self.factored_Kff, modified, modified)
+                solver = LowRankUpdateSolver(self.base_solver, modified, C.toarray() if sp.issparse(C) else C)
+                try:
+                    solver.factorize(Kff)
+                    return solver
+                except SingularMatrixError:
+                    pass
+        solver = self.create_solver()
+        try:
+            solver.factorize(Kff)
+        except SingularMatrixError:
+            self.inv_test(Kff)
+        self.base_solver = solver
+        self.factored_Kff = Kff
+        self.modified_dofs = np.zeros(0, dtype=int)
+        return solver
+
+    def create_solver(self):
+        if self.solver == 'auto':
+            return get_solver('sparse' if self.is_sparse() else 'cholesky')
+        return get_solver(self.solver)
+
+    # Solves with a solver factorized from Kff. The iterative solvers only meet a singular Kff here.
+    def solve(self, solver, Kff, b):
+        try:
+            return solver.solve(b)
+        except SingularMatrixError as error:
+            self.inv_test(Kff, error)
 
-    def inv_test(self, A):
+    # error, raised by the solver, is raised again if no mechanism is found. A solver that did not converge raises a
+    # ConvergenceError instead, which is not a sign of instability.
+    def inv_test(self, A, error: SingularMatrixError = None):
+        mechanisms = find_mechanisms(A, [self.displacements[i] for i in self.f])
+        if not mechanisms and error is not None:
+            raise error
         message = 'The stiffness matrix is singular. The structure is unstable.'
-        eig = np.linalg.eig(A)
-        x = [i for i in range(0, len(self.displacements))] @ self.f
-        eigenvalues = self.zero(eig.eigenvalues)
-        eigenvectors = []
-        for i in range(0, len(eigenvalues)):
-            if eigenvalues[i] == 0:
-                eigenvectors.append(eig.eigenvectors[i])
-        eigenvectors_rref, _, _ = rref.rref(np.array(eigenvectors))
-        for eigenvector in eigenvectors_rref:
-            message += '\n'
-            for j in range(0, len(eigenvector)):
-                component = eigenvector[j]
-                if component != 0:
-                    displacement_id = int(x @ [[int(k == j)] for k in range(0, len(self.f[0]))])
-                    message += '\n+ ' + str(component) + ' * (' + self.displacements[displacement_id].__str__() + ')'
-            message += ' = 0'
-        raise Exception(message)
+        for mechanism in mechanisms:
+            message += '\n\n' + mechanism.__str__()
+        raise UnstableStructureError(message, mechanisms)
+
+    def get_element_local_displacements(self, D=None, elements=slice(None)):
+        arguments = [self.T[elements], self.gather(self.D if D is None else D, elements)]
+        if np.any(self.condensed[elements]):
+            arguments.append(self.element_recovery[elements])
+        return self.map_elements(get_local_displacement_batch, arguments)
 
     def calculate_element_displacements(self):
-        self.element_D = []
-        for element in self.elements:
-            i = element.id
-            K = element.get_K()
-            D = self.zero(self.T[i] @ self.D)
-            self.element_D.append(D)
+        self.element_D = self.get_element_local_displacements()
 
     def calculate_element_forces(self):
-        self.element_P = []
-        for element in self.elements:
-            i = element.id
-            K = element.get_K()
-            P = self.zero(K @ self.T[i] @ self.D)
-            self.element_P.append(P)
+        D = self.get_element_local_displacements()
+        self.element_P = self.map_elements(np.matmul, [self.element_local_K, D])
+
+    # Starts from the linear solution. Load cases are solved one by one, since their axial forces differ.
+    def calculate_p_delta(self, tolerance: float = P_DELTA_TOLERANCE, max_iterations: int = P_DELTA_MAX_ITERATIONS,
+                          tangent_interval: int = 0):
+        lengths = self.model.get_lengths()
+        # The condensed released displacements follow the joined ones, as in the linear analysis.
+        T = self.T if not np.any(self.condensed) else self.T + self.element_recovery @ self.T
+        D = self.D.copy()
+        P = np.zeros(self.P.shape)
+        element_P = np.zeros(self.element_P.shape)
+        self.p_delta_report = []
+        for j in range(0, len(self.load_cases)):
+            start = time.perf_counter()
+            Pf = self.P[self.f, j]
+            Df = D[self.f, j]
+            report = {
+                'load_case': self.load_cases[j].name,
+                'iterations': 0,
+                'factorizations': 0,
+                'factorization_time': 0,
+                'residuals': []
+            }
+            for iteration in range(0, max_iterations + 1):
+                d = self.get_element_local_displacements(D[:, j:j + 1])
+                # Axial force, positive in tension
+                N = np.einsum('ej,ej->e', self.element_local_K[:, 6] - self.element_local_K[:, 0], d[:, :, 0]) / 2
+                local_K_G = self.map_elements(get_geometric_K_batch, [lengths, N])
+                K = self.K + self.assemble(self.map_elements(get_global_K_batch, [local_K_G, T]), self.element_dofs)
+                Kff = self.partition(K, self.f, self.f)
+                R = Pf - Kff @ Df
+                residual = np.linalg.norm(R) / max(np.linalg.norm(Pf), np.finfo(float).tiny)
+                report['residuals'].append(float(residual))
+                if residual <= tolerance:
+                    break
+                if iteration == max_iterations:
+                    raise Exception('The P-Delta analysis of ' + self.load_cases[j].__str__() +
+                                    ' did not converge in ' + str(max_iterations) + ' iterations.')
+                try:
+                    if iteration == 0 or (tangent_interval > 0 and iteration % tangent_interval == 0):
+                        solver = self.create_solver()
+                        solver.factorize(Kff)
+                        report['factorizations'] += 1
+                        report['factorization_time'] += solver.factorization_time
+                    # The iterative solvers only meet a singular or indefinite tangent while solving.
+                    Df = Df + np.asarray(solver.solve_matrix(R)).reshape(R.shape)
+                except SingularMatrixError:
+                    raise Exception('The tangent stiffness matrix of ' + self.load_cases[j].__str__() +
+                                    ' is singular. The axial forces exceed the buckling load.')
+                D[self.f, j] = Df
+                report['iterations'] += 1
+            P[:, j] = K @ D[:, j]
+            element_P[:, :, j] = ((self.element_local_K + local_K_G) @ d)[:, :, 0]
+            report['time'] = time.perf_counter() - start
+            self.p_delta_report.append(report)
+        self.D = D
+        self.P = P
+        self.element_P = element_P
 
-    def quad(self, S, A, T):
-        return np.transpose(S) @ A @ T
+    # Each column of the forces matrix is the load at one of the Nodes, and the supports do not move.
+    def calculate_influence(self, nodes: list, load=UNIT_LOAD, elements: list = None):
+        node_ids = np.array([node if isinstance(node, (int, np.integer)) else node.id for node in nodes], dtype=int)
+        if elements is None:
+            element_ids = np.arange(0, self.model.get_element_count())
+        else:
+            element_ids = np.array([e if isinstance(e, (int, np.integer)) else e.id for e in elements], dtype=int)
+        P = np.zeros([self.get_displacement_count(), len(node_ids)])
+        P[self.displacement_map['nodes'][node_ids], np.arange(0, len(node_ids))[:, np.newaxis]] = load
+        Kff = self.partition(self.K, self.f, self.f)
+        self.linear_solver = self.factorize(Kff)
+        D = np.zeros(P.shape)
+        D[self.f] = self.solve(self.linear_solver, Kff, P[self.f])
+        self.solver_report = self.linear_solver.get_report()
+        self.influence_D = D
+        D = self.get_element_local_displacements(self.influence_D, element_ids)
+        self.influence_P = self.map_elements(np.matmul, [self.element_local_K[element_ids], D])
+        self.influence = Influence(
+            node_ids,
+            element_ids,
+            np.transpose(self.influence_D[self.displacement_order]),
+            np.transpose(self.influence_P, [2, 0, 1])
+        )
 
+    # The results are kept as solved, so that combinations and the forces derived from the displacements stay exact.
+    # Values close to zero are only cleared when printed or written.
     def zero(self, A):
-        A[np.isclose(A, 0, atol=10e-6)] = 0
-        return A
+        return np.where(np.isclose(A, 0, atol=10e-6), 0, A)
 
+    def get_results(self, load=0):
+        if isinstance(load, LoadCombination):
+            weights = load.get_weights(len(self.load_cases))
+        else:
+            load = self.load_cases[load] if isinstance(load, int) else load
+            weights = np.zeros(len(self.load_cases))
+            weights[load.id] = 1
+        weights = weights[:, np.newaxis]
+        return Results(
+            load.name,
+            self.D[self.displacement_order] @ weights,
+            self.P[self.displacement_order] @ weights,
+            self.element_D @ weights,
+            self.element_P @ weights
+        )
+
+    # pandas, like the other reporting and plotting libraries, is only imported once results are printed, so that
+    # importing and running the Analyzer stays fast.
     def print_results(self):
+        import pandas as pd
         pd.set_option('display.max_columns', None)
+        for load_case in self.load_cases:
+            if len(self.load_cases) > 1:
+                print(load_case.__str__().capitalize())
+                print('')
+            self.print_load_results(self.get_results(load_case))
+            print('')
+        print('Solver')
+        report = self.solver_report
+        print(report['solver'] + ': ' + str(report['size']) + ' equations, factorization time ' +
+              '%.6f' % report['factorization_time'] + ' s, solve time ' + '%.6f' % report['solve_time'] +
+              ' s, residual ' + '%.3e' % report['residual'])
+        if self.renumbering_report is not None:
+            report = self.renumbering_report
+            print('Renumbering: bandwidth ' + str(report['bandwidth'][0]) + ' -> ' + str(report['bandwidth'][1]) +
+                  ', profile ' + str(report['profile'][0]) + ' -> ' + str(report['profile'][1]))
+
+    def print_load_results(self, results):
+        import pandas as pd
         print('Nodes')
-        displacement_range = range(0, len(self.displacements))
-        displacement_data = np.array([[self.D[i][0], self.P[i][0]] for i in displacement_range])
-        displacement_indices = [self.displacements[i].__str__() for i in displacement_range]
+        D, P, element_P = self.zero(results.D), self.zero(results.P), self.zero(results.element_P)
+        displacement_range = range(0, self.get_displacement_count())
+        displacement_data = np.array([[D[i][0], P[i][0]] for i in displacement_range])
+        displacement_indices = [self.displacements[self.displacement_order[i]].__str__() for i in displacement_range]
         df = pd.DataFrame(displacement_data, displacement_indices, ['Displacement', 'Force'])
         print(df)
         print('')
         print('Elements')
-        element_range = range(0, len(self.elements))
-        element_data = np.array([[self.element_P[i][j][0] for j in range(0, 12)] for i in element_range])
+        element_range = range(0, self.model.get_element_count())
+        element_data = np.array([[element_P[i][j][0] for j in range(0, 12)] for i in element_range])
         element_columns = ['Force ' + str(j) for j in range(0, 12)]
         df = pd.DataFrame(element_data, element_range, element_columns)
         print(df)
@@ -0,0 +1,162 @@
+from analyzer import Analyzer
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from mechanism import UnstableStructureError
+from model import Model
+import os
+import storage
+import time
+
+# Pools are kept alive between batches, so that the workers start and import the analysis modules only once.
+pools = {}
+
+
+# The solver modules are imported lazily by the Analyzer, so they are warmed up here along with it.
+def initialize_worker():
+    import analyzer
+    import scipy.linalg
+    import scipy.sparse.csgraph
+    import scipy.sparse.linalg
+
+
+def get_pool(workers: int = None):
+    workers = workers or os.cpu_count()
+    if workers not in pools:
+        pools[workers] = ProcessPoolExecutor(max_workers=workers, initializer=initialize_worker)
+    return pools[workers]
+
+
+# A pool is broken for good once one of its workers dies, so it is replaced by a new one.
+def replace_pool(pool, workers: int = None):
+    for key in [key for key, value in pools.items() if value is pool]:
+        del pools[key]
+    pool.shutdown(wait=False)
+    return get_pool(workers)
+
+
+def shutdown_pools():
+    for pool in pools.values():
+        pool.shutdown()
+    pools.clear()
+
+
+# Directories of the models saved by storage.save_model under directory, in the order of their names
+def get_model_paths(directory: str):
+    paths = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(os.path.join(path, 'metadata.json')):
+            paths.append(path)
+    return paths
+
+
+def get_name(source, index: int):
+    if isinstance(source, tuple):
+        return str(source[0])
+    if isinstance(source, str):
+        return os.path.basename(os.path.normpath(source))
+    return str(index)
+
+
+# Analyzes a single model, given as a path, a Model or a (name, Model) pair. Any error is caught and recorded, so that
+# it does not stop the batch.
+def analyze_model(source, name: str, options: dict = None):
+    start = time.perf_counter()
+    record = {'name': name}
+    try:
+        if isinstance(source, tuple):
+            source = source[1]
+        model = source if isinstance(source, Model) else storage.load_model(source)
+        analyzer = Analyzer(model=model, verbose=False, **(options or {}))
+        analyzer.analyze()
+        order = analyzer.displacement_order
+        record.update({
+            'status': 'ok',
+            'load_cases': [load_case.name for load_case in analyzer.load_cases],
+            'D': analyzer.D[order],
+            'P': analyzer.P[order],
+            'element_D': analyzer.element_D,
+            'element_P': analyzer.element_P,
+            'displacement_ids': analyzer.displacement_ids[order],
+        })
+    except UnstableStructureError as error:
+        # The mechanisms are only counted, since they are listed displacement by displacement.
+        record.update({
+            'status': 'unstable',
+            'error': str(error).split('\n')[0],
+            'mechanisms': len(error.mechanisms)
+        })
+    except Exception as error:
+        record.update({'status': 'error', 'error': type(error).__name__ + ': ' + str(error)})
+    record['time'] = time.perf_counter() - start
+    return record
+
+
+# Analyzes the sources on the executor and yields their records in order. At most window models are in flight, so that
+# the records waiting to be saved stay few. If a worker dies, e.g. killed for running out of memory, every model in the
+# pool fails with BrokenProcessPool: the pool is replaced and these models are analyzed again one at a time, so that
+# only the model that kills its worker is recorded as failed.
+def analyze_models(sources: list, options: dict, executor, workers: int = None, window: int = None):
+    window = window or 2 * (workers or os.cpu_count())
+    names = [get_name(sources[i], i) for i in range(0, len(sources))]
+    futures = deque()
+    retries = deque()
+    i = 0
+    while i < len(sources) or futures or retries:
+        if retries:
+            j = retries.popleft()
+            start = time.perf_counter()
+            try:
+                yield executor.submit(analyze_model, sources[j], names[j], options).result()
+            except BrokenProcessPool as error:
+                executor = replace_pool(executor, workers)
+                yield {'name': names[j], 'status': 'error', 'error': 'BrokenProcessPool: ' + str(error),
+                       'time': time.perf_counter() - start}
+            continue
+        try:
+            while i < len(sources) and len(futures) < window:
+                futures.append((i, executor.submit(analyze_model, sources[i], names[i], options)))
+                i += 1
+        except BrokenProcessPool:
+            if not futures:
+                executor = replace_pool(executor, workers)
+                continue
+        j, future = futures.popleft()
+        try:
+            yield future.result()
+        except BrokenProcessPool:
+            executor = replace_pool(executor, workers)
+            retries.extend([j] + [k for k, _ in futures])
+            futures.clear()
+
+
+# Analyzes the models (a directory of saved models, or an iterable of paths, Models or (name, Model) pairs) on a warm
+# process pool and saves all results into a single store at path, each as soon as it is ready. Returns the status of
+# each model.
+def run_batch(models, path: str, workers: int = None, options: dict = None, executor=None, window: int = None):
+    if isinstance(models, str):
+        models = get_model_paths(models)
+    records = analyze_models(list(models), options, executor or get_pool(workers), workers, window)
+    return storage.save_batch_results(path, records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyze a directory of saved models in parallel.')
+    parser.add_argument('models', help='Directory of models saved by storage.save_model')
+    parser.add_argument('results', help='Directory to save the results to')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--solver', default='auto')
+    parser.add_argument('--window', type=int, help='Models in flight at a time, twice the workers by default')
+    arguments = parser.parse_args()
+    models = run_batch(arguments.models, arguments.results, arguments.workers, {'solver': arguments.solver},
+                       window=arguments.window)
+    for model in models:
+        if model['status'] != 'ok':
+            print(model['name'] + ': ' + model['status'] + ', ' + model['error'])
+    print(str(sum(model['status'] == 'ok' for model in models)) + ' of ' + str(len(models)) + ' models analyzed.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,483 @@
+from analyzer import Analyzer
+import argparse
+import datetime
+from element import clear_caches
+import json
+from mechanism import UnstableStructureError
+from model import Model
+import numpy as np
+import os
+import platform
+from profiler import Profiler
+import scipy
+from solver import ConvergenceError
+import subprocess
+import sys
+import time
+
+SIZES = [10, 100, 1000, 10000, 100000, 1000000]
+KINDS = ['frame', 'truss', 'grid']
+# Changes of the structure between an incremental analysis and its re-analysis
+CHANGES = ['none', 'loads', 'member']
+# Numbers of members and solvers of the cantilevers checked, whose stiffness matrices are stable but ill-conditioned
+CANTILEVERS = [(400, 'cholesky'), (400, 'sparse'), (400, 'cg'), (1000, 'cholesky'), (1000, 'sparse'), (1000, 'cg'),
+               (3000, 'sparse')]
+# Largest relative error of the tip deflection of a cantilever
+CANTILEVER_TOLERANCE = 1e-3
+# Relative slowdown of a stage reported as a regression by compare
+REGRESSION_THRESHOLD = 0.2
+# Stages faster than this in the baseline are too noisy to compare
+REGRESSION_MIN_TIME = 0.001
+# Modules of the numerical core, and the libraries they must not load when imported
+CORE_MODULES = ['analyzer', 'element', 'node', 'collection']
+OPTIONAL_MODULES = ['pandas', 'matplotlib', 'scipy.sparse.linalg', 'scipy.sparse.csgraph']
+IMPORT_SCRIPT = '''import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps([time.perf_counter() - start, [module for module in {optional} if module in sys.modules]]))
+'''
+
+
+def get_lattice(counts):
+    grids = np.meshgrid(*[np.arange(0, count + 1) for count in counts], indexing='ij')
+    ids = np.arange(0, grids[0].size).reshape(grids[0].shape)
+    return ids, np.column_stack([grid.ravel() for grid in grids]).astype(float)
+
+
+# Pairs of node ids of a lattice joined along offset, e.g. [1, 0, 0] for the members along x and [1, 0, 1] for the
+# diagonals of the xz faces
+def get_members(ids, offset):
+    start = tuple(slice(0, n - o) for n, o in zip(ids.shape, offset))
+    end = tuple(slice(o, n) for n, o in zip(ids.shape, offset))
+    return np.column_stack([ids[start].ravel(), ids[end].ravel()])
+
+
+def get_model(positions, connectivity, node_rigidity, element_rigidity, forces):
+    return Model(
+        positions,
+        forces,
+        node_rigidity,
+        connectivity,
+        np.zeros(len(connectivity)),
+        np.zeros(len(connectivity)),
+        np.zeros(len(connectivity)),
+        element_rigidity,
+        [[1, 1, 1, 1]],
+        [[200, 0.3]]
+    )
+
+
+# bays_x by bays_y bays, stories high, fixed columns supported at the ground and beams joined by release
+def get_space_frame(bays_x: int, bays_y: int, stories: int, release: int = 0o7777, support: int = 0o77):
+    ids, positions = get_lattice([bays_x, bays_y, stories])
+    columns = get_members(ids, [0, 0, 1])
+    beams = np.concatenate([get_members(ids[:, :, 1:], [1, 0, 0]), get_members(ids[:, :, 1:], [0, 1, 0])])
+    forces = np.zeros([len(positions), 6])
+    forces[:, 0] = 2
+    forces[:, 2] = -1
+    return get_model(
+        positions,
+        np.concatenate([columns, beams]),
+        np.where(positions[:, 2] == 0, support, 0),
+        np.concatenate([np.full(len(columns), 0o7777), np.full(len(beams), release)]),
+        forces
+    )
+
+
+# Lattice of cubes with every edge and one diagonal per face, supported at the ground. The rotations of the Nodes are
+# fixed, since the members are hinged by release.
+def get_space_truss(bays_x: int, bays_y: int, stories: int, release: int = 0o1717, support: int = 0o77):
+    ids, positions = get_lattice([bays_x, bays_y, stories])
+    offsets = [[1, 0, 0], [0, 1, 0], [0, 0, 1], [1, 1, 0], [1, 0, 1], [0, 1, 1]]
+    members = np.concatenate([get_members(ids, offset) for offset in offsets])
+    forces = np.zeros([len(positions), 6])
+    forces[:, 2] = -1
+    return get_model(
+        positions,
+        members,
+        np.where(positions[:, 2] == 0, support, 0o70),
+        np.full(len(members), release),
+        forces
+    )
+
+
+# Horizontal grid of beams, bays_x by bays_y, supported along its edges
+def get_grid(bays_x: int, bays_y: int, release: int = 0o7777, support: int = 0o07):
+    ids, positions = get_lattice([bays_x, bays_y])
+    positions = np.column_stack([positions, np.zeros(len(positions))])
+    beams = np.concatenate([get_members(ids, [1, 0]), get_members(ids, [0, 1])])
+    edges = (positions[:, 0] == 0) | (positions[:, 0] == bays_x) | (positions[:, 1] == 0) | (positions[:, 1] == bays_y)
+    forces = np.zeros([len(positions), 6])
+    forces[:, 2] = -1
+    return get_model(positions, beams, np.where(edges, support, 0), np.full(len(beams), release), forces)
+
+
+# Steel cantilever along x (in kN and m), fixed at x = 0 and meshed into members of length 0.1, with a unit load down at
+# its tip
+def get_cantilever(members: int):
+    positions = np.zeros([members + 1, 3])
+    positions[:, 0] = np.arange(0, members + 1) / 10
+    forces = np.zeros([members + 1, 6])
+    forces[-1, 2] = -1
+    model = get_model(
+        positions,
+        np.column_stack([np.arange(0, members), np.arange(1, members + 1)]),
+        np.concatenate([[0o77], np.zeros(members, dtype=int)]),
+        np.full(members, 0o7777),
+        forces
+    )
+    model.section_properties = np.array([[0.01, 1e-4, 1e-4, 2e-4]])
+    model.material_properties = np.array([[2e8, 0.3]])
+    return model
+
+
+# Structure of the given kind with about the given number of displacements
+def get_structure(kind: str, dofs: int, release: int = None, support: int = None):
+    options = {name: value for name, value in [('release', release), ('support', support)] if value is not None}
+    if kind == 'frame':
+        n = max(1, round((dofs / 6) ** (1 / 3)) - 1)
+        return get_space_frame(n, n, n, **options)
+    if kind == 'truss':
+        n = max(1, round((dofs / 6) ** (1 / 3)) - 1)
+        return get_space_truss(n, n, n, **options)
+    if kind == 'grid':
+        n = max(1, round((dofs / 6) ** (1 / 2)) - 1)
+        return get_grid(n, n, **options)
+    raise Exception('Unknown structure ' + str(kind) + '. Available structures: ' + ', '.join(KINDS) + '.')
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Import of module in a new interpreter, so that nothing is cached by earlier imports. The time is the best of repeat
+# imports, along with the optional libraries loaded by the import.
+def run_import_benchmark(module: str, repeat: int = 5):
+    times = []
+    for i in range(0, repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', IMPORT_SCRIPT.format(module=module, optional=OPTIONAL_MODULES)],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+        ).stdout
+        import_time, optional_modules = json.loads(output)
+        times.append(import_time)
+    return {'module': module, 'time': min(times), 'optional_modules': optional_modules}
+
+
+def run_import_benchmarks(modules: list = None, repeat: int = 5, callback=None):
+    results = []
+    for module in modules or CORE_MODULES:
+        record = run_import_benchmark(module, repeat)
+        results.append(record)
+        if callback is not None:
+            callback(record)
+    return results
+
+
+def analyze(model: Model, profiler: Profiler, options: dict):
+    clear_caches()
+    analyzer = Analyzer(model=model, verbose=False, profile=profiler, **options)
+    start = time.perf_counter()
+    analyzer.analyze()
+    return analyzer, time.perf_counter() - start
+
+
+def change_model(model: Model, change: str):
+    if change == 'loads':
+        model.forces[:, 2] -= 1
+    elif change == 'member':
+        model.section_properties = np.vstack([model.section_properties, 2 * model.section_properties[0]])
+        model.section_ids[0] = len(model.section_properties) - 1
+
+
+# Re-analysis of an incremental Analyzer after each change, checked against a new analysis of the changed structure.
+# The times are the best of repeat runs.
+def run_reanalysis_benchmark(kind: str, dofs: int, repeat: int = 3, release: int = None, support: int = None,
+                             options: dict = None):
+    options = options or {}
+    record = {'kind': kind, 'size': dofs, 'changes': {}}
+    for change in CHANGES:
+        times = []
+        for i in range(0, repeat):
+            model = get_structure(kind, dofs, release, support)
+            analyzer, total_time = analyze(model, None, dict(options, incremental=True))
+            change_model(model, change)
+            start = time.perf_counter()
+            analyzer.analyze()
+            times.append(time.perf_counter() - start)
+        reference, total_time = analyze(model, None, options)
+        record['changes'][change] = {
+            'time': min(times),
+            'full_time': total_time,
+            'solver': analyzer.solver_report['solver'],
+            'matches': bool(np.allclose(analyzer.D, reference.D) and
+                            np.allclose(analyzer.element_P, reference.element_P)),
+        }
+    return record
+
+
+# Tip deflection of a cantilever against P L^3 / 3 E I. The status is 'ok', 'wrong', 'unstable' if the stable
+# cantilever is reported unstable, or 'not converged' if an iterative solver gives up on its conditioning.
+def run_cantilever_check(members: int, solver: str):
+    model = get_cantilever(members)
+    exact = -(members / 10) ** 3 / 3 / 2e8 / 1e-4
+    record = {'members': members, 'solver': solver, 'exact': exact}
+    try:
+        analyzer, record['time'] = analyze(model, None, {'solver': solver})
+    except UnstableStructureError:
+        record['status'] = 'unstable'
+        return record
+    except ConvergenceError:
+        record['status'] = 'not converged'
+        return record
+    record['deflection'] = float(analyzer.get_results(0).D.min())
+    record['status'] = 'ok' if abs(record['deflection'] - exact) <= CANTILEVER_TOLERANCE * abs(exact) else 'wrong'
+    return record
+
+
+# The times are the best of repeat runs without memory tracing, and the peak memory is taken from one more traced run.
+def run_benchmark(kind: str, dofs: int, repeat: int = 3, memory: bool = True, release: int = None,
+                  support: int = None, options: dict = None):
+    model = get_structure(kind, dofs, release, support)
+    options = options or {}
+    times = []
+    stage_times = {}
+    for i in range(0, repeat):
+        analyzer, total_time = analyze(model, Profiler(memory=False), options)
+        times.append(total_time)
+        for record in analyzer.profile_report['stages']:
+            stage_times.setdefault(record['stage'], []).append(record['time'])
+    record = {
+        'kind': kind,
+        'size': dofs,
+        'dofs': analyzer.get_displacement_count(),
+        'free_dofs': len(analyzer.f),
+        'nodes': model.get_node_count(),
+        'elements': model.get_element_count(),
+        'solver': analyzer.solver_report['solver'],
+        'time': min(times),
+        'stages': {stage: {'time': min(stage_times[stage])} for stage in stage_times},
+    }
+    for stage in analyzer.profile_report['stages']:
+        record['stages'][stage['stage']]['matrices'] = stage['matrices']
+    if memory:
+        analyzer, total_time = analyze(model, Profiler(memory=True), options)
+        for stage in analyzer.profile_report['stages']:
+            record['stages'][stage['stage']]['peak_memory'] = stage['peak_memory']
+        record['peak_memory'] = analyzer.profile_report['peak_memory']
+    return record
+
+
+# Exponent b of time ~ dofs^b fitted over the sizes of each kind, end to end and per stage
+def get_scaling(results: list):
+    scaling = {}
+    for kind in sorted(set(record['kind'] for record in results)):
+        records = [record for record in results if record['kind'] == kind]
+        if len(records) < 2:
+            continue
+        dofs = np.log([record['dofs'] for record in records])
+        curves = {'total': [record['time'] for record in records]}
+        for stage in records[0]['stages']:
+            if all(stage in record['stages'] for record in records):
+                curves[stage] = [record['stages'][stage]['time'] for record in records]
+        scaling[kind] = {
+            name: float(np.polyfit(dofs, np.log(np.maximum(times, 1e-9)), 1)[0]) for name, times in curves.items()
+        }
+    return scaling
+
+
+def run_benchmarks(kinds: list = None, sizes: list = None, repeat: int = 3, memory: bool = True, release: int = None,
+                   support: int = None, options: dict = None, callback=None, imports: bool = True,
+                   import_callback=None, reanalysis: bool = False, reanalysis_callback=None, cantilevers: bool = False,
+                   cantilever_callback=None):
+    import_results = run_import_benchmarks(repeat=max(repeat, 5), callback=import_callback) if imports else []
+    cantilever_results = []
+    for members, solver in CANTILEVERS if cantilevers else []:
+        record = run_cantilever_check(members, solver)
+        cantilever_results.append(record)
+        if cantilever_callback is not None:
+            cantilever_callback(record)
+    results = []
+    reanalysis_results = []
+    for kind in KINDS if kinds is None else kinds:
+        for size in sizes or SIZES:
+            record = run_benchmark(kind, size, repeat, memory, release, support, options)
+            results.append(record)
+            if callback is not None:
+                callback(record)
+            if reanalysis:
+                record = run_reanalysis_benchmark(kind, size, repeat, release, support, options)
+                reanalysis_results.append(record)
+                if reanalysis_callback is not None:
+                    reanalysis_callback(record)
+    return {
+        'commit': get_commit(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'options': options or {},
+        'imports': import_results,
+        'results': results,
+        'reanalysis': reanalysis_results,
+        'cantilevers': cantilever_results,
+        'scaling': get_scaling(results),
+    }
+
+
+# Stages (and totals) of the same kind and size that got slower than threshold relative to the baseline report
+def compare(baseline: dict, report: dict, threshold: float = REGRESSION_THRESHOLD):
+    regressions = []
+    baseline_records = {(record['kind'], record['size']): record for record in baseline['results']}
+    for record in report['results']:
+        base = baseline_records.get((record['kind'], record['size']))
+        if base is None:
+            continue
+        times = [('total', base['time'], record['time'])]
+        times += [(stage, base['stages'][stage]['time'], record['stages'][stage]['time'])
+                  for stage in record['stages'] if stage in base['stages']]
+        for stage, base_time, time in times:
+            if base_time >= REGRESSION_MIN_TIME and time > (1 + threshold) * base_time:
+                regressions.append({
+                    'kind': record['kind'],
+                    'size': record['size'],
+                    'stage': stage,
+                    'baseline': base_time,
+                    'time': time,
+                    'ratio': time / base_time
+                })
+    baseline_reanalysis = {(record['kind'], record['size']): record for record in baseline.get('reanalysis', [])}
+    for record in report.get('reanalysis', []):
+        base = baseline_reanalysis.get((record['kind'], record['size']))
+        for change, times in record['changes'].items() if base is not None else []:
+            base_time = base['changes'].get(change, {}).get('time', 0)
+            if base_time >= REGRESSION_MIN_TIME and times['time'] > (1 + threshold) * base_time:
+                regressions.append({
+                    'kind': record['kind'],
+                    'size': record['size'],
+                    'stage': 'reanalysis after ' + change,
+                    'baseline': base_time,
+                    'time': times['time'],
+                    'ratio': times['time'] / base_time
+                })
+    baseline_imports = {record['module']: record for record in baseline.get('imports', [])}
+    for record in report.get('imports', []):
+        base = baseline_imports.get(record['module'])
+        if base is not None and base['time'] >= REGRESSION_MIN_TIME and record['time'] > (1 + threshold) * base['time']:
+            regressions.append({
+                'kind': 'import',
+                'size': record['module'],
+                'stage': 'import',
+                'baseline': base['time'],
+                'time': record['time'],
+                'ratio': record['time'] / base['time']
+            })
+    return regressions
+
+
+# Core modules loading optional libraries when imported, or taking longer than max_time to import
+def check_imports(report: dict, max_time: float = None):
+    errors = []
+    for record in report['imports']:
+        if record['optional_modules']:
+            errors.append('importing ' + record['module'] + ' loads ' + ', '.join(record['optional_modules']))
+        if max_time is not None and record['time'] > max_time:
+            errors.append('importing ' + record['module'] + ' takes ' + '%.4f' % record['time'] + ' s')
+    return errors
+
+
+# Re-analyses whose results differ from a new analysis
+def check_reanalysis(report: dict):
+    return [record['kind'] + ' ' + str(record['size']) + ' after ' + change + ' differs from a new analysis'
+            for record in report.get('reanalysis', []) for change, times in record['changes'].items()
+            if not times['matches']]
+
+
+# Cantilevers reported unstable or with a wrong deflection
+def check_cantilevers(report: dict):
+    return ['cantilever of ' + str(record['members']) + ' members (' + record['solver'] + ') is ' + record['status']
+            for record in report.get('cantilevers', []) if record['status'] in ['unstable', 'wrong']]
+
+
+def print_cantilever_record(record: dict):
+    print('cantilever of ' + str(record['members']) + ' members (' + record['solver'] + '): ' + record['status'] +
+          (', deflection ' + '%.6g' % record['deflection'] + ' (exact ' + '%.6g' % record['exact'] + ')'
+           if 'deflection' in record else ''))
+
+
+def print_reanalysis_record(record: dict):
+    print(record['kind'] + ' ' + str(record['size']) + ' re-analysis: ' + ', '.join(
+        change + ' ' + '%.4f' % times['time'] + ' s (' + times['solver'] + ')' + ('' if times['matches'] else ' WRONG')
+        for change, times in record['changes'].items()))
+
+
+def print_import_record(record: dict):
+    print('import ' + record['module'] + ': ' + '%.4f' % record['time'] + ' s' +
+          (', loads ' + ', '.join(record['optional_modules']) if record['optional_modules'] else ''))
+
+
+def print_record(record: dict):
+    print(record['kind'] + ' ' + str(record['dofs']) + ' DOFs (' + record['solver'] + '): ' + '%.4f' % record['time'] +
+          ' s' + (', peak memory ' + str(record['peak_memory']) + ' B' if 'peak_memory' in record else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Analyzer on synthetic structures.')
+    parser.add_argument('--kinds', nargs='+', default=KINDS, choices=KINDS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES, help='Approximate numbers of displacements')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help='Skip the traced run measuring peak memory')
+    parser.add_argument('--release', type=lambda x: int(x, 0), help='Rigidity flag of the members, e.g. 0o1717')
+    parser.add_argument('--support', type=lambda x: int(x, 0), help='Rigidity flag of the supports, e.g. 0o77')
+    parser.add_argument('--solver')
+    parser.add_argument('--output', help='JSON file to write the report to')
+    parser.add_argument('--compare', help='JSON report of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument('--no-imports', action='store_true', help='Skip the import time of the core modules')
+    parser.add_argument('--imports-only', action='store_true', help='Only measure the import time of the core modules')
+    parser.add_argument('--max-import-time', type=float, help='Longest import time in seconds of each core module')
+    parser.add_argument('--reanalysis', action='store_true',
+                        help='Also time incremental re-analyses after no change, a change of the loads and of a member')
+    parser.add_argument('--cantilevers', action='store_true',
+                        help='Also check the tip deflection of long, finely meshed cantilevers with each solver')
+    arguments = parser.parse_args()
+    options = {'solver': arguments.solver} if arguments.solver else {}
+    kinds = [] if arguments.imports_only else arguments.kinds
+    report = run_benchmarks(kinds, arguments.sizes, arguments.repeat, not arguments.no_memory, arguments.release,
+                            arguments.support, options, print_record, not arguments.no_imports, print_import_record,
+                            arguments.reanalysis, print_reanalysis_record, arguments.cantilevers,
+                            print_cantilever_record)
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    for kind, exponents in report['scaling'].items():
+        print(kind + ' scaling: ' + ', '.join(name + ' ' + '%.2f' % exponent for name, exponent in exponents.items()))
+    failed = False
+    for error in check_imports(report, arguments.max_import_time):
+        print('Import: ' + error)
+        failed = True
+    for error in check_reanalysis(report):
+        print('Re-analysis: ' + error)
+        failed = True
+    for error in check_cantilevers(report):
+        print('Cantilever: ' + error)
+        failed = True
+    if arguments.compare:
+        with open(arguments.compare) as file:
+            regressions = compare(json.load(file), report, arguments.threshold)
+        for regression in regressions:
+            print('Regression: ' + regression['kind'] + ' ' + str(regression['size']) + ' ' + regression['stage'] +
+                  ' ' + '%.4f' % regression['baseline'] + ' s -> ' + '%.4f' % regression['time'] + ' s')
+        failed = failed or bool(regressions)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
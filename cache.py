@@ -0,0 +1,89 @@
+from collections import OrderedDict
+import numpy as np
+
+# Largest ratio of distinct keys to keys in a batch for which the cache is used
+DISTINCT_RATIO = 0.5
+
+
+class MatrixCache:
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.matrices = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def get(self, key, calculate):
+        if key in self.matrices:
+            self.hits += 1
+            self.matrices.move_to_end(key)
+            return self.matrices[key]
+        self.misses += 1
+        return self.set(key, calculate())
+
+    # Returns the stacked matrices of all keys, calculating the missing ones in a single call of calculate, which receives
+    # the positions (in keys) of one element per missing key.
+    def get_batch(self, keys: list, calculate):
+        matrices = {}
+        missing = []
+        for position, key in enumerate(keys):
+            if key in matrices:
+                continue
+            if key in self.matrices:
+                self.matrices.move_to_end(key)
+                matrices[key] = self.matrices[key]
+            else:
+                matrices[key] = None
+                missing.append(position)
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing)
+        if len(missing) > 0:
+            for position, matrix in zip(missing, calculate(np.array(missing, dtype=int))):
+                matrices[keys[position]] = self.set(keys[position], matrix)
+        return np.stack([matrices[key] for key in keys]) if len(keys) > 0 else np.zeros([0])
+
+    # Same as get_batch, for keys given as the rows of an array. Equal rows are looked up once. When most rows are
+    # distinct, e.g. for the orientations of an irregular model, or there are more of them than the cache holds, the
+    # lookups would cost more than they save, so the distinct rows are calculated without the cache.
+    def get_array_batch(self, keys, calculate):
+        keys = np.asarray(keys, dtype=float).reshape([len(keys), -1])
+        if len(keys) == 0:
+            return self.get_batch([], calculate)
+        first, inverse = get_distinct_rows(keys)
+        self.hits += len(keys) - len(first)
+        if len(first) > DISTINCT_RATIO * len(keys) or len(first) > self.max_size:
+            self.bypassed += len(first)
+            if len(first) == len(keys):
+                return np.asarray(calculate(np.arange(0, len(keys))), dtype=float)
+            return np.asarray(calculate(first), dtype=float)[inverse]
+        return self.get_batch([tuple(keys[i].tolist()) for i in first], lambda i: calculate(first[i]))[inverse]
+
+    def set(self, key, matrix):
+        matrix = np.array(matrix, dtype=float)
+        matrix.flags.writeable = False
+        self.matrices[key] = matrix
+        if len(self.matrices) > self.max_size:
+            self.matrices.popitem(last=False)
+        return matrix
+
+    def clear(self):
+        self.matrices.clear()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'bypassed': self.bypassed, 'size': len(self.matrices)}
+
+
+# Returns the position of the first of each distinct row and the index of the distinct row of each row, like
+# np.unique(keys, axis=0), but sorts a hash of the rows instead of the rows. The rows are checked against the distinct
+# rows they were hashed to, in case two of them collide. Adding 0 turns -0 into 0, which has other bits.
+def get_distinct_rows(keys):
+    keys = np.ascontiguousarray(keys, dtype=float) + 0.0
+    multipliers = (2 * np.arange(0, keys.shape[1], dtype=np.uint64) + 1) * np.uint64(0x9E3779B97F4A7C15)
+    hashes = (keys.view(np.uint64) * multipliers).sum(axis=1)
+    _, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+    if not np.array_equal(keys[first][inverse], keys):
+        _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    return first, inverse.ravel()
@@ -1,4 +1,5 @@
 import util
+from cache import MatrixCache
 from collection_item import CollectionItem
 import math
 from material import Material
@@ -17,71 +18,328 @@ class Element(CollectionItem):
                  rigidity_int: int = 0b000111001111):
         self.node_0 = node_0
         self.node_1 = node_1
-        self.L = math.dist(node_0.position, node_1.position)
         self.theta = theta
-        self.calculate_cosine_matrix()
-
         self.section = section
+        self.material = material
+        self.rigidity_int = rigidity_int
+
+    @property
+    def theta(self):
+        return self._theta
+
+    @theta.setter
+    def theta(self, theta: float):
+        self._theta = theta
+        self.positions = None
+
+    @property
+    def section(self):
+        return self._section
+
+    @section.setter
+    def section(self, section: Section):
+        self._section = section
         self.A = section.A
         self.I2 = section.I2
         self.I3 = section.I3
         self.J = section.J
+        self.invalidate()
 
-        self.material = material
+    @property
+    def material(self):
+        return self._material
+
+    @material.setter
+    def material(self, material: Material):
+        self._material = material
         self.E = material.E
         self.G = material.G
+        self.rho = material.rho
+        self.invalidate()
+
+    @property
+    def rigidity_int(self):
+        return self._rigidity_int
 
+    @rigidity_int.setter
+    def rigidity_int(self, rigidity_int: int):
+        self._rigidity_int = rigidity_int
         self.rigidity_matrix = util.get_rigidity_matrix(rigidity_int, 12)
+        self.invalidate()
+
+    @property
+    def L(self):
+        self.calculate_cosine_matrix()
+        return self._L
+
+    @property
+    def cosine_matrix(self):
+        self.calculate_cosine_matrix()
+        return self._cosine_matrix
 
     def get_nodes(self):
         return [self.node_0, self.node_1]
 
+    def invalidate(self):
+        self.K = None
+        self.T = None
+        self.joint_T = None
+        self.global_K = None
+
+    # Recalculated only when the node positions or theta have changed since the last call
     def calculate_cosine_matrix(self):
-        x1 = self.node_0.position
-        x2 = self.node_1.position
-        X = [(x2[i] - x1[i]) / self.L for i in range(0, 3)]
-        if abs(X[2]) != 1:
-            Z = np.cross(X, [0, 0, 1])
-            Z = Z / np.linalg.norm(Z)
-        else:
-            Z = [1, 0, 0]
-        Y = np.cross(Z, X)
-        theta_rad = math.radians(self.theta)
-        cos = math.cos(theta_rad)
-        sin = math.sin(theta_rad)
-        self.cosine_matrix = np.matmul([[1, 0, 0], [0, cos, sin], [0, -sin, cos]], [X, Y, Z])
-
-    # P V2 V3  T M2 M3
-    # 0  1  2  3  4  5
-    # 6  7  8  9 10 11
+        positions = (tuple(self.node_0.position), tuple(self.node_1.position))
+        if positions == self.positions:
+            return
+        self.positions = positions
+        self._L = math.dist(*positions)
+        self._cosine_matrix = get_cosine_matrix_batch([positions[0]], [positions[1]], [self.theta])[0]
+        self.invalidate()
+
+    def get_K_key(self):
+        return self.L, self.A, self.I2, self.I3, self.J, self.E, self.G
+
+    def get_M_key(self, lumped: bool = False):
+        return self.L, self.A, self.J, self.rho, lumped
+
+    def get_T_key(self):
+        return tuple(self.cosine_matrix.ravel())
+
+    def get_joint_T_key(self):
+        return self.get_T_key() + (self.rigidity_int,)
+
+    def get_global_K_key(self):
+        return self.get_K_key() + self.get_joint_T_key()
+
     def get_K(self):
-        L = self.L
-        A = self.A
-        I3 = self.I3
-        I2 = self.I2
-        J = self.J
-        E = self.E
-        G = self.G
-        K = np.zeros([12, 12])
-        for k in [0, 1]:
-            for l in [0, 1]:
-                K[6 * k + 0][6 * l + 0] = (-1) ** (k + l) * A * E / L
-                K[6 * k + 1][6 * l + 1] = (-1) ** (k + l) * 12 * E * I3 / L ** 3
-                K[6 * k + 2][6 * l + 2] = (-1) ** (k + l) * 12 * E * I2 / L ** 3
-                K[6 * k + 1][6 * l + 5] = (-1) ** (k + 0) * 6 * E * I3 / L ** 2
-                K[6 * k + 2][6 * l + 4] = (-1) ** (k + 1) * 6 * E * I2 / L ** 2
-                K[6 * k + 4][6 * l + 2] = (-1) ** (l + 1) * 6 * E * I2 / L ** 2
-                K[6 * k + 5][6 * l + 1] = (-1) ** (l + 0) * 6 * E * I3 / L ** 2
-                K[6 * k + 5][6 * l + 5] = (3 + (-1) ** (k + l)) * E * I3 / L
-                K[6 * k + 4][6 * l + 4] = (3 + (-1) ** (k + l)) * E * I2 / L
-                K[6 * k + 3][6 * l + 3] = (-1) ** (k + l) * G * J / L
-        return K
+        self.calculate_cosine_matrix()
+        if self.K is None:
+            self.K = K_cache.get(self.get_K_key(), lambda: get_K_batch(*[[x] for x in self.get_K_key()])[0])
+        return self.K
+
+    def get_M(self, lumped: bool = False):
+        return M_cache.get(self.get_M_key(lumped), lambda: get_M_batch(*[[x] for x in self.get_M_key(lumped)])[0])
 
     def get_T(self):
-        T3 = self.cosine_matrix
-        T = np.zeros([12, 12])
-        for k in range(0, 4):
-            for l in range(0, 3):
-                for m in range(0, 3):
-                    T[3 * k + l][3 * k + m] = T3[l][m]
-        return T
\ No newline at end of file
+        self.calculate_cosine_matrix()
+        if self.T is None:
+            self.T = T_cache.get(self.get_T_key(), lambda: get_T_batch([self.cosine_matrix])[0])
+        return self.T
+
+    def get_joint_T(self):
+        self.calculate_cosine_matrix()
+        if self.joint_T is None:
+            self.joint_T = joint_T_cache.get(
+                self.get_joint_T_key(),
+                lambda: get_joint_T_batch([self.get_T()], [self.rigidity_matrix])[0]
+            )
+        return self.joint_T
+
+    def get_global_K(self):
+        self.calculate_cosine_matrix()
+        if self.global_K is None:
+            self.global_K = global_K_cache.get(
+                self.get_global_K_key(),
+                lambda: get_global_K_batch([self.get_K()], [self.get_joint_T()])[0]
+            )
+        return self.global_K
+
+
+def get_cosine_matrix_batch(positions_0, positions_1, theta):
+    d = np.asarray(positions_1, dtype=float) - np.asarray(positions_0, dtype=float)
+    X = d / np.linalg.norm(d, axis=1)[:, np.newaxis]
+    Z = np.cross(X, [0, 0, 1])
+    Z[np.abs(X[:, 2]) == 1] = [1, 0, 0]
+    Z = Z / np.linalg.norm(Z, axis=1)[:, np.newaxis]
+    Y = np.cross(Z, X)
+    theta_rad = np.radians(theta)
+    cos = np.cos(theta_rad)
+    sin = np.sin(theta_rad)
+    zeros = np.zeros(len(theta_rad))
+    ones = np.ones(len(theta_rad))
+    rotation = np.array([[ones, zeros, zeros], [zeros, cos, sin], [zeros, -sin, cos]]).transpose([2, 0, 1])
+    return rotation @ np.stack([X, Y, Z], axis=1)
+
+
+# P V2 V3  T M2 M3
+# 0  1  2  3  4  5
+# 6  7  8  9 10 11
+def get_K_patterns():
+    patterns = np.zeros([8, 12, 12])
+    for k in [0, 1]:
+        for l in [0, 1]:
+            patterns[0][6 * k + 0][6 * l + 0] = (-1) ** (k + l)
+            patterns[1][6 * k + 1][6 * l + 1] = (-1) ** (k + l)
+            patterns[2][6 * k + 2][6 * l + 2] = (-1) ** (k + l)
+            patterns[3][6 * k + 1][6 * l + 5] = (-1) ** (k + 0)
+            patterns[4][6 * k + 2][6 * l + 4] = (-1) ** (k + 1)
+            patterns[4][6 * k + 4][6 * l + 2] = (-1) ** (l + 1)
+            patterns[3][6 * k + 5][6 * l + 1] = (-1) ** (l + 0)
+            patterns[5][6 * k + 5][6 * l + 5] = (3 + (-1) ** (k + l))
+            patterns[6][6 * k + 4][6 * l + 4] = (3 + (-1) ** (k + l))
+            patterns[7][6 * k + 3][6 * l + 3] = (-1) ** (k + l)
+    return patterns
+
+
+K_patterns = get_K_patterns()
+
+
+def get_K_batch(L, A, I2, I3, J, E, G):
+    L, A, I2, I3, J, E, G = [np.asarray(x, dtype=float) for x in [L, A, I2, I3, J, E, G]]
+    coefficients = np.stack([
+        A * E / L,
+        12 * E * I3 / L ** 3,
+        12 * E * I2 / L ** 3,
+        6 * E * I3 / L ** 2,
+        6 * E * I2 / L ** 2,
+        E * I3 / L,
+        E * I2 / L,
+        G * J / L,
+    ], axis=1)
+    return np.einsum('et,tij->eij', coefficients, K_patterns)
+
+
+# Geometric stiffness of an element under the axial force N (positive in tension). Coefficients: N / L, N and N L.
+def get_geometric_K_patterns():
+    patterns = np.zeros([3, 12, 12])
+    for k in [0, 1]:
+        for l in [0, 1]:
+            patterns[0][6 * k + 1][6 * l + 1] = 6 / 5 * (-1) ** (k + l)
+            patterns[0][6 * k + 2][6 * l + 2] = 6 / 5 * (-1) ** (k + l)
+            # Translation at end k and rotation at end l
+            patterns[1][6 * k + 1][6 * l + 5] = (-1) ** k / 10
+            patterns[1][6 * l + 5][6 * k + 1] = (-1) ** k / 10
+            patterns[1][6 * k + 2][6 * l + 4] = -(-1) ** k / 10
+            patterns[1][6 * l + 4][6 * k + 2] = -(-1) ** k / 10
+            patterns[2][6 * k + 5][6 * l + 5] = 2 / 15 if k == l else -1 / 30
+            patterns[2][6 * k + 4][6 * l + 4] = 2 / 15 if k == l else -1 / 30
+    return patterns
+
+
+geometric_K_patterns = get_geometric_K_patterns()
+
+
+def get_geometric_K_batch(L, N):
+    L, N = [np.asarray(x, dtype=float) for x in [L, N]]
+    coefficients = np.stack([N / L, N, N * L], axis=1)
+    return np.einsum('et,tij->eij', coefficients, geometric_K_patterns)
+
+
+# Coefficients: rho A L, rho A L^2, rho A L^3 and rho J L. The rotary inertia of the cross-section is neglected in
+# bending.
+def get_M_patterns(lumped: bool = False):
+    patterns = np.zeros([4, 12, 12])
+    if lumped:
+        for j in [0, 1, 2, 6, 7, 8]:
+            patterns[0][j][j] = 1 / 2
+        for j in [3, 9]:
+            patterns[3][j][j] = 1 / 2
+        return patterns
+    for k in [0, 1]:
+        for l in [0, 1]:
+            patterns[0][6 * k + 0][6 * l + 0] = (1 + (k == l)) / 6
+            patterns[0][6 * k + 1][6 * l + 1] = (156 if k == l else 54) / 420
+            patterns[0][6 * k + 2][6 * l + 2] = (156 if k == l else 54) / 420
+            patterns[2][6 * k + 5][6 * l + 5] = (4 if k == l else -3) / 420
+            patterns[2][6 * k + 4][6 * l + 4] = (4 if k == l else -3) / 420
+            patterns[3][6 * k + 3][6 * l + 3] = (1 + (k == l)) / 6
+            # Translation at end k and rotation at end l
+            coupling = (22 if k == l else 13) * (-1) ** l / 420
+            patterns[1][6 * k + 1][6 * l + 5] = coupling
+            patterns[1][6 * l + 5][6 * k + 1] = coupling
+            patterns[1][6 * k + 2][6 * l + 4] = -coupling
+            patterns[1][6 * l + 4][6 * k + 2] = -coupling
+    return patterns
+
+
+M_patterns = {False: get_M_patterns(False), True: get_M_patterns(True)}
+
+
+def get_M_batch(L, A, J, rho, lumped=False):
+    L, A, J, rho = [np.asarray(x, dtype=float) for x in [L, A, J, rho]]
+    m = rho * A * L
+    coefficients = np.stack([m, m * L, m * L ** 2, rho * J * L], axis=1)
+    lumped = np.broadcast_to(np.asarray(lumped, dtype=bool), L.shape)
+    M = np.zeros([len(L), 12, 12])
+    for value in [False, True]:
+        M[lumped == value] = np.einsum('et,tij->eij', coefficients[lumped == value], M_patterns[value])
+    return M
+
+
+def get_T_batch(cosine_matrices):
+    T3 = np.asarray(cosine_matrices, dtype=float).reshape([-1, 3, 3])
+    T = np.zeros([len(T3), 12, 12])
+    for k in range(0, 4):
+        T[:, 3 * k:3 * k + 3, 3 * k:3 * k + 3] = T3
+    return T
+
+
+# Maps the 6 displacements of each node followed by the 12 release displacements of the element onto its 12 local
+# displacements: rotated for the DOFs joined to the nodes, and directly for the released ones.
+def get_joint_T_batch(T, rigidity_matrices):
+    T = np.asarray(T, dtype=float).reshape([-1, 12, 12])
+    joined = np.asarray(rigidity_matrices).reshape([-1, 12]) == 1
+    return np.concatenate([joined[:, :, np.newaxis] * T, np.eye(12) * ~joined[:, :, np.newaxis]], axis=2)
+
+
+def get_global_K_batch(K, joint_T):
+    return np.transpose(joint_T, [0, 2, 1]) @ K @ joint_T
+
+
+# Statically condenses the released DOFs out of each stiffness matrix, K_jj - K_jr K_rr^-1 K_rj, and returns the matrices
+# recovering the released displacements from the joined ones, d_r = -K_rr^-1 K_rj d_j. Elements whose released block is
+# singular are left as they are and flagged as not condensable.
+def get_condensation_batch(K, rigidity_matrices):
+    K = np.asarray(K, dtype=float).reshape([-1, 12, 12])
+    joined = np.asarray(rigidity_matrices).reshape([-1, 12]) == 1
+    condensed_K = K.copy()
+    recovery = np.zeros(K.shape)
+    condensable = np.ones(len(K), dtype=bool)
+    patterns, inverse = np.unique(joined, axis=0, return_inverse=True)
+    for p in range(0, len(patterns)):
+        j = np.flatnonzero(patterns[p])
+        r = np.flatnonzero(~patterns[p])
+        if len(r) == 0:
+            continue
+        i = np.flatnonzero(inverse.ravel() == p)
+        K_rr = K[np.ix_(i, r, r)]
+        stable = np.linalg.matrix_rank(K_rr) == len(r)
+        condensable[i[~stable]] = False
+        i = i[stable]
+        if len(i) == 0:
+            continue
+        X = np.linalg.solve(K_rr[stable], K[np.ix_(i, r, j)])
+        condensed_K[i] = 0
+        condensed_K[np.ix_(i, j, j)] = K[np.ix_(i, j, j)] - K[np.ix_(i, j, r)] @ X
+        recovery[np.ix_(i, r, j)] = -X
+    return condensed_K, recovery, condensable
+
+
+# Local displacements of each element from its gathered global displacements, with the condensed released ones recovered
+def get_local_displacement_batch(joint_T, D, recovery=None):
+    D = joint_T @ D
+    if recovery is not None:
+        D = D + recovery @ D
+    return D
+
+
+K_cache = MatrixCache()
+M_cache = MatrixCache()
+T_cache = MatrixCache()
+joint_T_cache = MatrixCache()
+global_K_cache = MatrixCache()
+
+
+def get_cache_stats():
+    return {
+        'K': K_cache.get_stats(),
+        'M': M_cache.get_stats(),
+        'T': T_cache.get_stats(),
+        'joint_T': joint_T_cache.get_stats(),
+        'global_K': global_K_cache.get_stats(),
+    }
+
+
+def clear_caches():
+    for cache in [K_cache, M_cache, T_cache, joint_T_cache, global_K_cache]:
+        cache.clear()
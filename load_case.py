@@ -0,0 +1,26 @@
+from collection_item import CollectionItem
+import numpy as np
+
+
+class LoadCase(CollectionItem):
+    def __init__(self, name: str, forces: list):
+        self.name = name
+        self.forces = forces
+
+    def __str__(self):
+        return 'load case ' + self.name
+
+
+class LoadCombination:
+    def __init__(self, name: str, factors: list):
+        self.name = name
+        self.factors = factors
+
+    def get_weights(self, n: int):
+        weights = np.zeros(n)
+        for load_case, factor in self.factors:
+            weights[load_case.id] += factor
+        return weights
+
+    def __str__(self):
+        return 'load combination ' + self.name
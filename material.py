@@ -1,5 +1,6 @@
 class Material:
-    def __init__(self, E: float, nu: float):
+    def __init__(self, E: float, nu: float, rho: float = 0):
         self.E = E
         self.nu = nu
+        self.rho = rho
         self.G = E / 2 / (1 + nu)
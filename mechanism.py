@@ -0,0 +1,144 @@
+import numpy as np
+import scipy.sparse as sp
+
+# Coefficients smaller than this fraction of the largest one in a mechanism are dropped.
+COEFFICIENT_TOLERANCE = 1e-10
+# Fraction of the diagonal added to K while searching for its deficient displacements, so that no pivot is exactly zero
+PERTURBATION = 1e-12
+# Rayleigh quotients, as fractions of the diagonal, below which a displacement is suspected of being deficient. The
+# displacements only suspected are told apart by their Schur complement.
+DEFICIENCY_TOLERANCE = 1e-8
+# Rayleigh quotients, as fractions of the diagonal, of the candidate null vectors
+NULL_TOLERANCE = 1e-10
+# A candidate x is only a mechanism if |A x| is rounding error, at most this fraction of |A| |x|, A being K scaled to a
+# unit diagonal. A stable but ill-conditioned K, e.g. of a long member meshed into many Elements, has candidates with
+# small Rayleigh quotients too.
+RESIDUAL_TOLERANCE = 1e3 * np.finfo(float).eps
+# Number of right-hand sides solved at once, keeping the dense solutions small
+SOLVE_CHUNK_SIZE = 256
+
+
+class Mechanism:
+    def __init__(self, displacements: list, coefficients):
+        self.displacements = displacements
+        self.coefficients = coefficients
+
+    def __str__(self):
+        terms = ['+ ' + str(self.coefficients[i]) + ' * (' + self.displacements[i].__str__() + ')'
+                 for i in range(0, len(self.displacements))]
+        return '\n'.join(terms) + ' = 0'
+
+
+class UnstableStructureError(Exception):
+    def __init__(self, message: str, mechanisms: list):
+        super().__init__(message)
+        self.mechanisms = mechanisms
+
+
+def factorize(A):
+    import scipy.sparse.linalg as spla
+    return spla.splu(sp.csc_matrix(A), permc_spec='MMD_AT_PLUS_A', diag_pivot_thresh=0, options={'SymmetricMode': True})
+
+
+# Pivots of A + shift I by column. The k-th pivot of SuperLU belongs to the column j with perm_c[j] = k.
+def get_pivots(A, shift: float):
+    factor = factorize(A + shift * sp.eye(A.shape[0]))
+    return factor.U.diagonal()[factor.perm_c]
+
+
+# Displacements of A, scaled to a unit diagonal, left out until the others factorize with Rayleigh quotients above
+# DEFICIENCY_TOLERANCE. The pivot of a displacement is the least x^T A x of the x with a unit coefficient on it and
+# none on the displacements eliminated after it, so it grows by shift x^T x with a shift of the diagonal: two shifted
+# factorizations give its Rayleigh quotient. A pivot following a small one may be spoiled by it, so the factorization
+# is repeated without the displacements found so far.
+def get_deficient_displacements(A):
+    deficient = np.zeros(A.shape[0], dtype=bool)
+    while not np.all(deficient):
+        indices = np.flatnonzero(~deficient)
+        B = A[indices][:, indices]
+        pivots = get_pivots(B, PERTURBATION)
+        norms = np.maximum((get_pivots(B, 2 * PERTURBATION) - pivots) / PERTURBATION, 1)
+        small = (pivots <= 0) | (pivots / norms - PERTURBATION <= DEFICIENCY_TOLERANCE)
+        if not np.any(small):
+            break
+        deficient[indices[small]] = True
+    return np.flatnonzero(deficient)
+
+
+# A^-1 B as a sparse matrix, solved SOLVE_CHUNK_SIZE columns at a time
+def solve_sparse(A, B):
+    factor = factorize(A)
+    B = sp.csc_matrix(B)
+    chunks = [sp.csc_matrix(factor.solve(B[:, i:i + SOLVE_CHUNK_SIZE].toarray()).reshape([B.shape[0], -1]))
+              for i in range(0, B.shape[1], SOLVE_CHUNK_SIZE)]
+    return sp.hstack(chunks, format='csc') if chunks else sp.csc_matrix(B.shape)
+
+
+def get_column_norms(X):
+    if sp.issparse(X):
+        return np.sqrt(np.asarray(X.power(2).sum(axis=0)).ravel())
+    return np.linalg.norm(X, axis=0)
+
+
+# Whether each column x of X has an A x at rounding error
+def is_null(A, X):
+    return get_column_norms(A @ X) <= RESIDUAL_TOLERANCE * abs(A).sum(axis=0).max() * get_column_norms(X)
+
+
+# Null space of the positive semi-definite matrix A, scaled to a unit diagonal, as sparse columns. With the
+# displacements other than the deficient ones eliminated, x = V y with V = [I; -X] and x^T A x = y^T S y, S being the
+# (small) Schur complement of the deficient displacements. The null space is made of the x whose Rayleigh quotient
+# y^T S y / y^T V^T V y is at most NULL_TOLERANCE and A x is rounding error. Each column has a unit coefficient on one of the displacements
+# picked by a pivoted QR factorization, like the rows of a reduced row echelon form, which are also returned.
+def get_scaled_null_space(A):
+    import scipy.linalg
+    import scipy.sparse.linalg as spla
+    deficient = get_deficient_displacements(A)
+    rest = np.setdiff1d(np.arange(0, A.shape[0]), deficient)
+    X = solve_sparse(A[rest][:, rest], A[rest][:, deficient])
+    S = A[deficient][:, deficient] - A[deficient][:, rest] @ X
+    order = np.argsort(np.concatenate([deficient, rest]))
+    V = sp.vstack([sp.eye(len(deficient)), -X], format='csr')[order]
+    # All the quotients are small when S is, as V^T V >= I.
+    if spla.norm(S) <= NULL_TOLERANCE and np.all(is_null(A, V)):
+        return V, deficient
+    S = S.toarray()
+    eigenvalues, Y = scipy.linalg.eigh((S + S.T) / 2, (V.T @ V).toarray())
+    Y = Y[:, eigenvalues <= NULL_TOLERANCE]
+    # The eigenvectors are checked, rather than the columns with unit coefficients, which may mix them.
+    X = V @ Y
+    null = is_null(A, X)
+    X, Y = X[:, null], Y[:, null]
+    units = scipy.linalg.qr(Y.T, mode='r', pivoting=True)[1][:Y.shape[1]]
+    return sp.csr_matrix(X @ np.linalg.inv(Y[units])), deficient[units]
+
+
+# Returns a basis of the null space of the positive semi-definite matrix K, as the rows of a sparse matrix.
+# Displacements with a zero diagonal are mechanisms by themselves.
+def get_null_space(K):
+    K = sp.csc_matrix(K)
+    n = K.shape[0]
+    diagonal = K.diagonal()
+    zero = np.flatnonzero(diagonal <= 0)
+    active = np.flatnonzero(diagonal > 0)
+    scale = 1 / np.sqrt(diagonal[active])
+    vectors, units = get_scaled_null_space(sp.csc_matrix(sp.diags(scale) @ K[active][:, active] @ sp.diags(scale)))
+    # Scaled back, keeping the unit coefficients
+    vectors = sp.coo_matrix(sp.diags(scale) @ vectors @ sp.diags(1 / scale[units]))
+    rows = np.concatenate([np.arange(0, len(zero)), len(zero) + vectors.col])
+    columns = np.concatenate([zero, active[vectors.row]])
+    data = np.concatenate([np.ones(len(zero)), vectors.data])
+    basis = sp.csr_matrix((data, (rows, columns)), shape=(len(zero) + vectors.shape[1], n))
+    basis.sort_indices()
+    return basis
+
+
+def find_mechanisms(K, displacements: list):
+    basis = get_null_space(K)
+    mechanisms = []
+    for i in range(0, basis.shape[0]):
+        indices = basis.indices[basis.indptr[i]:basis.indptr[i + 1]]
+        coefficients = basis.data[basis.indptr[i]:basis.indptr[i + 1]]
+        kept = np.abs(coefficients) >= COEFFICIENT_TOLERANCE * np.abs(coefficients).max()
+        mechanisms.append(Mechanism([displacements[j] for j in indices[kept]], coefficients[kept]))
+    return mechanisms
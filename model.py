@@ -0,0 +1,124 @@
+from collection import Collection
+from element import Element, get_cosine_matrix_batch
+from material import Material
+import numpy as np
+from node import Node
+from section import Section
+
+
+def get_rigidity_matrices(rigidity_ints, n: int):
+    return (np.asarray(rigidity_ints, dtype=np.int64)[:, np.newaxis] >> np.arange(0, n)) & 1
+
+
+# Structure-of-arrays representation of a structure: one row per Node, Element, Section and Material.
+class Model:
+    def __init__(self,
+                 positions,
+                 forces,
+                 node_rigidity,
+                 connectivity,
+                 section_ids,
+                 material_ids,
+                 theta,
+                 element_rigidity,
+                 section_properties,
+                 material_properties):
+        # [x, y, z]
+        self.positions = np.asarray(positions, dtype=float).reshape([-1, 3])
+        # [Fx, Fy, Fz, Mx, My, Mz]
+        self.forces = np.asarray(forces, dtype=float).reshape([-1, 6])
+        self.node_rigidity = np.asarray(node_rigidity, dtype=np.uint8).reshape([-1])
+        # [n0, n1]
+        self.connectivity = np.asarray(connectivity, dtype=np.int32).reshape([-1, 2])
+        self.section_ids = np.asarray(section_ids, dtype=np.int32).reshape([-1])
+        self.material_ids = np.asarray(material_ids, dtype=np.int32).reshape([-1])
+        self.theta = np.asarray(theta, dtype=float).reshape([-1])
+        self.element_rigidity = np.asarray(element_rigidity, dtype=np.uint16).reshape([-1])
+        # [A, I2, I3, J]
+        self.section_properties = np.asarray(section_properties, dtype=float).reshape([-1, 4])
+        # [E, nu, rho], rho being 0 if not given
+        material_properties = np.asarray(material_properties, dtype=float)
+        material_properties = material_properties.reshape([-1, material_properties.shape[-1]])
+        if material_properties.shape[1] == 2:
+            material_properties = np.column_stack([material_properties, np.zeros(len(material_properties))])
+        self.material_properties = material_properties
+
+    def get_node_count(self):
+        return len(self.positions)
+
+    def get_element_count(self):
+        return len(self.connectivity)
+
+    def get_node_rigidity_matrices(self):
+        return get_rigidity_matrices(self.node_rigidity, 6)
+
+    def get_element_rigidity_matrices(self):
+        return get_rigidity_matrices(self.element_rigidity, 12)
+
+    def get_lengths(self, elements=slice(None)):
+        connectivity = self.connectivity[elements]
+        return np.linalg.norm(self.positions[connectivity[:, 1]] - self.positions[connectivity[:, 0]], axis=1)
+
+    def get_cosine_matrices(self, elements=slice(None)):
+        connectivity = self.connectivity[elements]
+        positions_0 = self.positions[connectivity[:, 0]]
+        positions_1 = self.positions[connectivity[:, 1]]
+        return get_cosine_matrix_batch(positions_0, positions_1, self.theta[elements])
+
+    # [L, A, I2, I3, J, E, G] of each element
+    def get_element_properties(self, elements=slice(None)):
+        section_properties = self.section_properties[self.section_ids[elements]]
+        material_properties = self.material_properties[self.material_ids[elements]]
+        E = material_properties[:, 0]
+        G = E / 2 / (1 + material_properties[:, 1])
+        return np.column_stack([self.get_lengths(elements), section_properties, E, G])
+
+    def get_element_densities(self, elements=slice(None)):
+        return self.material_properties[self.material_ids[elements], 2]
+
+
+def get_items(items: list):
+    indices = {}
+    unique_items = []
+    for item in items:
+        if id(item) not in indices:
+            indices[id(item)] = len(unique_items)
+            unique_items.append(item)
+    return unique_items, np.array([indices[id(item)] for item in items], dtype=np.int32)
+
+
+def from_collections(nodes: list, elements: list):
+    sections, section_ids = get_items([element.section for element in elements])
+    materials, material_ids = get_items([element.material for element in elements])
+    return Model(
+        [node.position for node in nodes],
+        [node.force for node in nodes],
+        [node.rigidity_int for node in nodes],
+        [[element.node_0.id, element.node_1.id] for element in elements],
+        section_ids,
+        material_ids,
+        [element.theta for element in elements],
+        [element.rigidity_int for element in elements],
+        [[section.A, section.I2, section.I3, section.J] for section in sections],
+        [[material.E, material.nu, material.rho] for material in materials]
+    )
+
+
+def to_collections(model: Model):
+    sections = [Section(*properties) for properties in model.section_properties.tolist()]
+    materials = [Material(*properties) for properties in model.material_properties.tolist()]
+    nodes = Collection([
+        Node(model.positions[i].tolist(), model.forces[i].tolist(), int(model.node_rigidity[i]))
+        for i in range(0, model.get_node_count())
+    ])
+    elements = Collection([
+        Element(
+            nodes.get(int(model.connectivity[i][0])),
+            nodes.get(int(model.connectivity[i][1])),
+            sections[model.section_ids[i]],
+            materials[model.material_ids[i]],
+            float(model.theta[i]),
+            int(model.element_rigidity[i])
+        ) for i in range(0, model.get_element_count())
+    ])
+    return nodes, elements
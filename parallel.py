@@ -0,0 +1,51 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import os
+
+CHUNK_SIZE = 2000
+
+executor_types = {'threads': ThreadPoolExecutor, 'processes': ProcessPoolExecutor}
+# Pools are kept alive and shared between analyses, so that workers are started only once.
+pools = {}
+
+
+def get_executor(executor, workers: int = None):
+    if executor is None or isinstance(executor, Executor):
+        return executor
+    if executor not in executor_types:
+        raise Exception('Unknown executor ' + str(executor) + '. Available executors: ' +
+                        ', '.join(executor_types) + '.')
+    workers = workers or os.cpu_count()
+    if (executor, workers) not in pools:
+        pools[(executor, workers)] = executor_types[executor](max_workers=workers)
+    return pools[(executor, workers)]
+
+
+def shutdown_executors():
+    for pool in pools.values():
+        pool.shutdown()
+    pools.clear()
+
+
+def get_chunks(count: int, chunk_size: int):
+    return [slice(start, min(start + chunk_size, count)) for start in range(0, count, chunk_size)]
+
+
+def concatenate(results: list):
+    if isinstance(results[0], tuple):
+        return tuple(concatenate(list(parts)) for parts in zip(*results))
+    if isinstance(results[0], list):
+        return [item for result in results for item in result]
+    return np.concatenate(results)
+
+
+# Calls function on chunks of the leading axis of arguments and joins the results in chunk order, so that the result is
+# the same as function(*arguments) whatever the executor. function must be picklable for the process executor.
+def map_chunks(function, arguments: list, executor=None, workers: int = None, chunk_size: int = CHUNK_SIZE):
+    count = len(arguments[0])
+    executor = get_executor(executor, workers)
+    if executor is None or count <= chunk_size:
+        return function(*arguments)
+    chunks = get_chunks(count, chunk_size)
+    results = executor.map(function, *[[argument[chunk] for chunk in chunks] for argument in arguments])
+    return concatenate(list(results))
@@ -0,0 +1,57 @@
+import numpy as np
+import scipy.sparse as sp
+import time
+import tracemalloc
+
+
+def get_matrix_size(A):
+    if sp.issparse(A):
+        return {
+            'shape': list(A.shape),
+            'nnz': int(A.nnz),
+            'bytes': int(sum(array.nbytes for array in [A.data, A.indices, A.indptr] if array is not None))
+        }
+    A = np.asarray(A)
+    return {'shape': list(A.shape), 'nnz': int(np.count_nonzero(A)), 'bytes': int(A.nbytes)}
+
+
+# Records the wall time, peak allocated memory (through tracemalloc, if memory is True) and the sizes of the matrices
+# built by each stage. Each callback is called with the record of a stage as soon as the stage ends.
+class Profiler:
+    def __init__(self, memory: bool = True, callbacks: list = None):
+        self.memory = memory
+        self.callbacks = callbacks or []
+        self.stages = []
+        self.tracing = False
+
+    def start(self):
+        self.stages = []
+        self.tracing = self.memory and not tracemalloc.is_tracing()
+        if self.tracing:
+            tracemalloc.start()
+
+    def stop(self):
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+
+    def run(self, name: str, function, get_matrices):
+        if self.memory:
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        result = function()
+        record = {'stage': name, 'time': time.perf_counter() - start}
+        if self.memory:
+            record['peak_memory'] = tracemalloc.get_traced_memory()[1] - memory_before
+        record['matrices'] = {name: get_matrix_size(A) for name, A in get_matrices().items()}
+        self.stages.append(record)
+        for callback in self.callbacks:
+            callback(record)
+        return result
+
+    def get_report(self):
+        report = {'stages': self.stages, 'time': sum(record['time'] for record in self.stages)}
+        if self.memory:
+            report['peak_memory'] = max([record['peak_memory'] for record in self.stages], default=0)
+        return report
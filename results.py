@@ -0,0 +1,52 @@
+import numpy as np
+
+
+class Results:
+    def __init__(self,
+                 name: str,
+                 D,
+                 P,
+                 element_D,
+                 element_P,
+                 load_case_names: list = None,
+                 displacement_ids=None):
+        self.name = name
+        self.D = D
+        self.P = P
+        self.element_D = element_D
+        self.element_P = element_P
+        self.load_case_names = load_case_names
+        self.displacement_ids = displacement_ids
+
+
+# Natural modes in ascending order of frequency. shapes are (displacements x modes), normalized to unit modal mass.
+class Modes:
+    def __init__(self, eigenvalues, shapes, displacement_ids=None):
+        self.eigenvalues = eigenvalues
+        self.angular_frequencies = np.sqrt(np.maximum(eigenvalues, 0))
+        self.frequencies = self.angular_frequencies / 2 / np.pi
+        self.periods = np.divide(1, self.frequencies, out=np.full(len(eigenvalues), np.inf),
+                                 where=self.frequencies > 0)
+        self.shapes = shapes
+        self.displacement_ids = displacement_ids
+
+
+# Results of a load moved over the Nodes of node_ids: D is (positions x displacements), in the original order, and
+# element_P is (positions x elements x 12), for the Elements of element_ids.
+class Influence:
+    def __init__(self, node_ids, element_ids, D, element_P):
+        self.node_ids = node_ids
+        self.element_ids = element_ids
+        self.D = D
+        self.element_P = element_P
+
+    # Largest and smallest force of each Element in each direction over the positions, scaled by factor, and the Nodes
+    # where the load causes them
+    def get_envelope(self, factor: float = 1):
+        element_P = factor * self.element_P
+        return {
+            'max': element_P.max(axis=0),
+            'min': element_P.min(axis=0),
+            'max_nodes': self.node_ids[element_P.argmax(axis=0)],
+            'min_nodes': self.node_ids[element_P.argmin(axis=0)],
+        }
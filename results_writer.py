@@ -0,0 +1,91 @@
+import numpy as np
+import os
+
+CHUNK_SIZE = 100000
+
+
+def get_column_names(names: list, load_cases: list):
+    if len(load_cases) == 1:
+        return names
+    return [name + ' ' + load_case.name for name in names for load_case in load_cases]
+
+
+def get_range_mask(ids, id_range: range):
+    if id_range is None:
+        return np.ones(len(ids), dtype=bool)
+    in_bounds = (ids >= id_range.start) & (ids < id_range.stop)
+    return in_bounds & ((ids - id_range.start) % id_range.step == 0)
+
+
+# Yields (column names, column formats, rows) chunk by chunk, each row being a displacement in the original order
+def get_displacement_chunks(analyzer, node_ids: range, element_ids: range, chunk_size: int):
+    names = ['object type', 'object id', 'local displacement id']
+    names += get_column_names(['displacement', 'force'], analyzer.load_cases)
+    formats = ['%d', '%d', '%d'] + ['%.10g'] * (len(names) - 3)
+    count = analyzer.get_displacement_count()
+    for start in range(0, count, chunk_size):
+        indices = analyzer.displacement_order[start:start + chunk_size]
+        ids = analyzer.displacement_ids[indices]
+        nodes = ids[:, 0] == 0
+        mask = (nodes & get_range_mask(ids[:, 1], node_ids)) | (~nodes & get_range_mask(ids[:, 1], element_ids))
+        indices = indices[mask]
+        D = analyzer.zero(analyzer.D[indices])
+        P = analyzer.zero(analyzer.P[indices])
+        yield names, formats, np.column_stack([ids[mask], np.stack([D, P], axis=1).reshape([len(indices), len(names) - 3])])
+
+
+def get_element_chunks(analyzer, element_ids: range, chunk_size: int):
+    names = ['element id'] + get_column_names(['force ' + str(j) for j in range(0, 12)], analyzer.load_cases)
+    formats = ['%d'] + ['%.10g'] * (len(names) - 1)
+    count = analyzer.model.get_element_count()
+    for start in range(0, count, chunk_size):
+        ids = np.arange(start, min(start + chunk_size, count))
+        ids = ids[get_range_mask(ids, element_ids)]
+        element_P = analyzer.zero(analyzer.element_P[ids])
+        yield names, formats, np.column_stack([ids, element_P.reshape([len(ids), len(names) - 1])])
+
+
+def write_csv(path: str, chunks):
+    with open(path, 'w') as file:
+        header_written = False
+        for names, formats, rows in chunks:
+            if not header_written:
+                file.write(','.join(names) + '\n')
+                header_written = True
+            np.savetxt(file, rows, fmt=formats, delimiter=',')
+
+
+def write_parquet(path: str, chunks):
+    import pyarrow
+    import pyarrow.parquet
+    writer = None
+    try:
+        for names, formats, rows in chunks:
+            columns = [rows[:, j].astype(int) if formats[j] == '%d' else rows[:, j] for j in range(0, len(names))]
+            table = pyarrow.table(columns, names=names)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+writers = {'csv': write_csv, 'parquet': write_parquet}
+
+
+# Writes displacements.<format> and elements.<format> into the directory at path, chunk by chunk, optionally limited
+# to ranges of node and element ids. Parquet needs pyarrow.
+def write_results(analyzer,
+                  path: str,
+                  format: str = 'csv',
+                  node_ids: range = None,
+                  element_ids: range = None,
+                  chunk_size: int = CHUNK_SIZE):
+    if format not in writers:
+        raise Exception('Unknown format ' + str(format) + '. Available formats: ' + ', '.join(writers) + '.')
+    os.makedirs(path, exist_ok=True)
+    write = writers[format]
+    write(os.path.join(path, 'displacements.' + format),
+          get_displacement_chunks(analyzer, node_ids, element_ids, chunk_size))
+    write(os.path.join(path, 'elements.' + format), get_element_chunks(analyzer, element_ids, chunk_size))
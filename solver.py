@@ -0,0 +1,208 @@
+import time
+import numpy as np
+import scipy.sparse as sp
+
+# scipy.linalg and scipy.sparse.linalg are imported by the solvers on their first use, to keep importing light.
+# A pivot, or a conjugate gradient curvature, smaller than this fraction of its diagonal entry is rounding error and
+# treated as zero. A stable but ill-conditioned matrix, e.g. of a long member meshed into many Elements, has pivots well
+# above it.
+PIVOT_TOLERANCE = 1e3 * np.finfo(float).eps
+
+
+class SingularMatrixError(Exception):
+    pass
+
+
+# Raised by an iterative solver that did not converge, which an ill-conditioned matrix causes as well as a singular one
+class ConvergenceError(Exception):
+    pass
+
+
+class Solver:
+    name = None
+
+    def __init__(self):
+        self.factorization_time = 0
+        self.solve_time = 0
+
+    def factorize(self, A):
+        start = time.perf_counter()
+        self.A = A
+        self.shape = A.shape
+        if A.shape[0] > 0:
+            self.factorize_matrix(A)
+        self.factorization_time = time.perf_counter() - start
+
+    def solve(self, b):
+        start = time.perf_counter()
+        x = self.solve_matrix(b) if self.shape[0] > 0 else np.zeros(b.shape)
+        x = np.asarray(x).reshape(b.shape)
+        self.solve_time = time.perf_counter() - start
+        self.residual = self.get_residual(x, b)
+        return x
+
+    def get_residual(self, x, b):
+        b_norm = np.linalg.norm(b)
+        if b_norm == 0:
+            return np.linalg.norm(x)
+        return np.linalg.norm(self.A @ x - b) / b_norm
+
+    def get_report(self):
+        return {
+            'solver': self.name,
+            'size': self.shape[0],
+            'factorization_time': self.factorization_time,
+            'solve_time': self.solve_time,
+            'residual': self.residual,
+        }
+
+    def factorize_matrix(self, A):
+        raise NotImplementedError
+
+    def solve_matrix(self, b):
+        raise NotImplementedError
+
+
+class CholeskySolver(Solver):
+    name = 'cholesky'
+
+    def factorize_matrix(self, A):
+        import scipy.linalg
+        if sp.issparse(A):
+            A = A.toarray()
+        try:
+            self.factor = scipy.linalg.cho_factor(A, lower=True, check_finite=False)
+        except np.linalg.LinAlgError:
+            raise SingularMatrixError()
+        pivots = np.diag(self.factor[0]) ** 2
+        if np.any(pivots <= PIVOT_TOLERANCE * np.diag(A)):
+            raise SingularMatrixError()
+
+    def solve_matrix(self, b):
+        import scipy.linalg
+        return scipy.linalg.cho_solve(self.factor, b, check_finite=False)
+
+
+class SparseDirectSolver(Solver):
+    name = 'sparse'
+
+    def factorize_matrix(self, A):
+        import scipy.sparse.linalg as spla
+        A = sp.csc_matrix(A)
+        try:
+            self.factor = spla.splu(A, permc_spec='MMD_AT_PLUS_A', diag_pivot_thresh=0,
+                                    options={'SymmetricMode': True})
+        except RuntimeError:
+            raise SingularMatrixError()
+        # With the pivots kept on the diagonal, they are those of an LDL^T factorization: a zero or negative one means
+        # that A is not positive definite. The k-th pivot belongs to the column j with perm_c[j] = k.
+        if not np.array_equal(self.factor.perm_r, self.factor.perm_c):
+            raise SingularMatrixError()
+        pivots = self.factor.U.diagonal()[self.factor.perm_c]
+        if np.any(pivots <= PIVOT_TOLERANCE * A.diagonal()):
+            raise SingularMatrixError()
+
+    def solve_matrix(self, b):
+        return self.factor.solve(b)
+
+
+class ConjugateGradientSolver(Solver):
+    name = 'cg'
+
+    def __init__(self, tolerance: float = 1e-10, max_iterations: int = None):
+        super().__init__()
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+
+    def factorize_matrix(self, A):
+        self.matrix = sp.csr_matrix(A)
+        self.diagonal = self.matrix.diagonal()
+        if np.any(self.diagonal <= 0):
+            raise SingularMatrixError()
+        self.iterations = []
+
+    # Jacobi-preconditioned conjugate gradients, iterating the unconverged columns of b at once. Nothing is factorized,
+    # so a singular or indefinite A is only met here, as a curvature p^T A p that is not positive relative to
+    # p^T diag(A) p, like a pivot. It may also keep the iterations from converging, but so may a poor conditioning.
+    def solve_matrix(self, b):
+        b = b.reshape(len(b), -1)
+        max_iterations = self.max_iterations or 10 * len(b)
+        inverse_diagonal = (1 / self.diagonal)[:, np.newaxis]
+        x = np.zeros(b.shape)
+        iterations = np.zeros(b.shape[1], dtype=int)
+        limits = self.tolerance * np.linalg.norm(b, axis=0)
+        columns = np.flatnonzero(np.linalg.norm(b, axis=0) > limits)
+        x_columns = np.zeros([len(b), len(columns)])
+        r = b[:, columns]
+        z = inverse_diagonal * r
+        p = z.copy()
+        rz = np.einsum('ij,ij->j', r, z)
+        while len(columns) > 0:
+            if iterations[columns[0]] >= max_iterations:
+                raise ConvergenceError('The conjugate gradient solver did not converge in ' + str(max_iterations) +
+                                       ' iterations.')
+            q = self.matrix @ p
+            curvatures = np.einsum('ij,ij->j', p, q)
+            if np.any(curvatures <= PIVOT_TOLERANCE * np.einsum('ij,ij->j', p, p / inverse_diagonal)):
+                raise SingularMatrixError()
+            alpha = rz / curvatures
+            x_columns += alpha * p
+            r -= alpha * q
+            z = inverse_diagonal * r
+            rz_next = np.einsum('ij,ij->j', r, z)
+            p = z + rz_next / rz * p
+            rz = rz_next
+            iterations[columns] += 1
+            converged = np.linalg.norm(r, axis=0) <= limits[columns]
+            if np.any(converged):
+                x[:, columns[converged]] = x_columns[:, converged]
+                columns, x_columns, r, p, rz = [a[..., ~converged] for a in [columns, x_columns, r, p, rz]]
+        self.iterations += iterations.tolist()
+        return x
+
+    def get_report(self):
+        report = super().get_report()
+        report['iterations'] = self.iterations
+        return report
+
+
+# Solves (A + U C U^T) x = b through the Sherman-Morrison-Woodbury identity, reusing the factorization of A. U selects
+# the rows and columns given by indices, and C is the dense change of A among them.
+class LowRankUpdateSolver(Solver):
+    def __init__(self, solver: Solver, indices, C):
+        super().__init__()
+        self.solver = solver
+        self.indices = np.asarray(indices, dtype=int)
+        self.C = np.asarray(C, dtype=float)
+        self.name = solver.name + ' + low-rank update'
+
+    def factorize_matrix(self, A):
+        import scipy.linalg
+        U = np.zeros([A.shape[0], len(self.indices)])
+        U[self.indices, np.arange(len(self.indices))] = 1
+        self.Z = np.asarray(self.solver.solve_matrix(U)).reshape(U.shape)
+        S = np.eye(len(self.indices)) + self.C @ self.Z[self.indices]
+        self.factor = scipy.linalg.lu_factor(S, check_finite=False)
+        pivots = np.abs(np.diag(self.factor[0]))
+        if np.any(pivots <= PIVOT_TOLERANCE * np.abs(S).max()):
+            raise SingularMatrixError()
+
+    def solve_matrix(self, b):
+        import scipy.linalg
+        y = np.asarray(self.solver.solve_matrix(b)).reshape(b.shape)
+        return y - self.Z @ scipy.linalg.lu_solve(self.factor, self.C @ y[self.indices], check_finite=False)
+
+
+solvers = {
+    CholeskySolver.name: CholeskySolver,
+    SparseDirectSolver.name: SparseDirectSolver,
+    ConjugateGradientSolver.name: ConjugateGradientSolver,
+}
+
+
+def get_solver(solver):
+    if isinstance(solver, Solver):
+        return solver
+    if solver not in solvers:
+        raise Exception('Unknown solver ' + str(solver) + '. Available solvers: ' + ', '.join(solvers) + '.')
+    return solvers[solver]()
@@ -0,0 +1,169 @@
+import json
+from model import Model
+import numpy as np
+import os
+from results import Results
+import shutil
+
+# A model or a result set is stored as a directory of raw .npy arrays, which are memory-mapped when loaded, plus a JSON
+# metadata file.
+MODEL_ARRAYS = [
+    'positions',
+    'forces',
+    'node_rigidity',
+    'connectivity',
+    'section_ids',
+    'material_ids',
+    'theta',
+    'element_rigidity',
+    'section_properties',
+    'material_properties',
+]
+RESULTS_ARRAYS = ['D', 'P', 'element_D', 'element_P', 'displacement_ids']
+FORMAT_VERSION = 1
+
+
+def save_arrays(path: str, arrays: dict, metadata: dict):
+    os.makedirs(path, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(path, name + '.npy'), np.ascontiguousarray(array))
+    metadata['version'] = FORMAT_VERSION
+    with open(os.path.join(path, 'metadata.json'), 'w') as file:
+        json.dump(metadata, file)
+
+
+def load_arrays(path: str, names: list, mmap_mode):
+    with open(os.path.join(path, 'metadata.json')) as file:
+        metadata = json.load(file)
+    if metadata.get('version') != FORMAT_VERSION:
+        raise Exception('Unsupported format version ' + str(metadata.get('version')) + ' in ' + path + '.')
+    return {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode) for name in names}, metadata
+
+
+def save_model(path: str, model: Model):
+    save_arrays(path, {name: getattr(model, name) for name in MODEL_ARRAYS}, {'type': 'model'})
+
+
+# The arrays are mapped copy-on-write, so the loaded Model can be modified without changing the file.
+def load_model(path: str, mmap: bool = True):
+    arrays, _ = load_arrays(path, MODEL_ARRAYS, 'c' if mmap else None)
+    return Model(**arrays)
+
+
+# Results are stored for all load cases, with the displacements in the original order: D and P are
+# (displacements x load cases), element_D and element_P are (elements x 12 x load cases).
+def save_results(path: str, analyzer):
+    order = analyzer.displacement_order
+    save_arrays(path, {
+        'D': analyzer.D[order],
+        'P': analyzer.P[order],
+        'element_D': analyzer.element_D,
+        'element_P': analyzer.element_P,
+        'displacement_ids': analyzer.displacement_ids[order],
+    }, {'type': 'results', 'load_cases': [load_case.name for load_case in analyzer.load_cases]})
+
+
+def load_results(path: str, mmap: bool = True):
+    arrays, metadata = load_arrays(path, RESULTS_ARRAYS, 'r' if mmap else None)
+    return Results(
+        os.path.basename(os.path.normpath(path)),
+        arrays['D'],
+        arrays['P'],
+        arrays['element_D'],
+        arrays['element_P'],
+        metadata['load_cases'],
+        arrays['displacement_ids']
+    )
+
+
+# The arrays are written model by model, appended to raw files that are given their .npy header once the batch is
+# complete, so that only the model being written is held in memory.
+class BatchWriter:
+    def __init__(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.files = {}
+        self.shapes = {}
+        self.dtypes = {}
+        self.displacement_offsets = [0]
+        self.element_offsets = [0]
+        self.load_cases = None
+        self.models = []
+
+    def write(self, record: dict):
+        model = {name: record[name] for name in ['name', 'status', 'time', 'error', 'mechanisms'] if name in record}
+        self.models.append(model)
+        if record['status'] != 'ok':
+            return
+        if self.load_cases is None:
+            self.load_cases = record['load_cases']
+        elif record['load_cases'] != self.load_cases:
+            model.update({'status': 'error', 'error': 'The load cases differ from those of the other models.'})
+            return
+        for name in RESULTS_ARRAYS:
+            array = np.ascontiguousarray(record[name])
+            if name not in self.files:
+                self.files[name] = open(os.path.join(self.path, name + '.raw'), 'wb')
+                self.shapes[name] = [0] + list(array.shape[1:])
+                self.dtypes[name] = array.dtype
+            array.astype(self.dtypes[name], copy=False).tofile(self.files[name])
+            self.shapes[name][0] += len(array)
+        self.displacement_offsets.append(self.displacement_offsets[-1] + len(record['D']))
+        self.element_offsets.append(self.element_offsets[-1] + len(record['element_D']))
+
+    def close(self):
+        arrays = {}
+        for name in RESULTS_ARRAYS:
+            if name not in self.files:
+                arrays[name] = np.zeros([0, 3] if name == 'displacement_ids' else
+                                        [0, 12, 0] if name.startswith('element') else [0, 0])
+                continue
+            self.files.pop(name).close()
+            raw = os.path.join(self.path, name + '.raw')
+            with open(os.path.join(self.path, name + '.npy'), 'wb') as file, open(raw, 'rb') as data:
+                np.lib.format.write_array_header_1_0(file, {
+                    'descr': np.lib.format.dtype_to_descr(self.dtypes[name]),
+                    'fortran_order': False,
+                    'shape': tuple(self.shapes[name]),
+                })
+                shutil.copyfileobj(data, file, 1 << 24)
+            os.remove(raw)
+        arrays['displacement_offsets'] = np.array(self.displacement_offsets)
+        arrays['element_offsets'] = np.array(self.element_offsets)
+        save_arrays(self.path, arrays, {
+            'type': 'batch',
+            'load_cases': self.load_cases or [],
+            'models': self.models,
+        })
+        return self.models
+
+
+# The results of many models are stored in the same arrays, one after another, with displacement_offsets and
+# element_offsets marking where each model starts. The models that failed are only listed in the metadata. records can
+# be any iterable, e.g. a generator of the records as they are computed.
+def save_batch_results(path: str, records):
+    writer = BatchWriter(path)
+    for record in records:
+        writer.write(record)
+    return writer.close()
+
+
+# Returns the Results of each successful model by name, slicing the memory-mapped arrays, and the status of all models.
+def load_batch_results(path: str, mmap: bool = True):
+    arrays, metadata = load_arrays(path, RESULTS_ARRAYS + ['displacement_offsets', 'element_offsets'],
+                                   'r' if mmap else None)
+    names = [model['name'] for model in metadata['models'] if model['status'] == 'ok']
+    results = {}
+    for i in range(0, len(names)):
+        displacements = slice(arrays['displacement_offsets'][i], arrays['displacement_offsets'][i + 1])
+        elements = slice(arrays['element_offsets'][i], arrays['element_offsets'][i + 1])
+        results[names[i]] = Results(
+            names[i],
+            arrays['D'][displacements],
+            arrays['P'][displacements],
+            arrays['element_D'][elements],
+            arrays['element_P'][elements],
+            metadata['load_cases'],
+            arrays['displacement_ids'][displacements]
+        )
+    return results, metadata['models']
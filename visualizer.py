@@ -1,114 +1,213 @@
-from matplotlib import pyplot
+from functools import partial
 import numpy as np
+import os
+from parallel import CHUNK_SIZE, get_chunks, get_executor, map_chunks
+import re
 
+# matplotlib is imported by the functions drawing, so that the graphs can be computed without it.
+SAMPLES = 8
+SHEAR_MAGNIFIER = 0.02
+MOMENT_MAGNIFIER = 0.05
+DEFORMATION_MAGNIFIER = 5
+COLORS = ['black', 'blue', 'red', 'green']
 
-def visualize(elements, analysis, sight):
-    element_original_shapes = []
-    shear_graphs = []
-    moment_graphs = []
-    element_deformed_shapes = []
-    for element in elements:
-        original_shape = get_original_shape(element)
-        element_original_shapes.append(original_shape)
-        shear_graph = get_shear_graph(element, analysis)
-        shear_graphs.append(shear_graph)
-        moment_graph = get_moment_graph(element, analysis)
-        moment_graphs.append(moment_graph)
-        deformed_shape = get_deformed_shape(element, analysis)
-        element_deformed_shapes.append(deformed_shape)
-    plot(element_original_shapes, sight, 'black')
-    plot(shear_graphs, sight, 'blue')
-    plot(moment_graphs, sight, 'red')
-    plot(element_deformed_shapes, sight, 'green')
+
+# Draws the Elements (all of them if elements is None) with their shear and moment graphs and deformed shape, each
+# sampled at samples + 1 points per Element.
+def visualize(elements, analysis, sight, load=0, samples: int = SAMPLES, executor=None, workers: int = None,
+              chunk_size: int = CHUNK_SIZE):
+    from matplotlib import pyplot
+    results = analysis.get_results(load)
+    ids = get_element_ids(analysis, elements)
+    graphs = map_chunks(
+        partial(get_graphs, samples=samples),
+        get_geometry(analysis.model, ids) + get_load_arguments(results, ids),
+        executor, workers, chunk_size
+    )
+    axes = pyplot.gca()
+    for graph, color in zip(graphs, COLORS):
+        plot(axes, graph, sight, color)
+    axes.autoscale_view()
     pyplot.show()
 
 
-def get_original_shape(element):
-    return [np.transpose([element.get_nodes()[j].position]) for j in [0, 1]]
-
-
-def get_shear_graph(element, analysis):
-    node_0 = element.get_nodes()[0]
-    node_1 = element.get_nodes()[1]
-    T = element.cosine_matrix
-    element_P = analysis.element_P[element.id]
-    V_2 = element_P[1]
-    V_3 = element_P[2]
-    graph = []
-    n = 8
-    magnifier = 0.02
-    graph.append(np.transpose(np.array([node_0.position])))
-    for i in range(0, n + 1):
-        x = i / n * element.L
-        point = np.array([
-            [i / n * element.L],
-            magnifier * V_2,
-            magnifier * V_3
-        ])
-        graph.append(np.transpose(np.array([node_0.position])) + np.transpose(T) @ point)
-    graph.append(np.transpose(np.array([node_1.position])))
-    return graph
-
-def get_moment_graph(element, analysis):
-    node_0 = element.get_nodes()[0]
-    node_1 = element.get_nodes()[1]
-    T = element.cosine_matrix
-    element_P = analysis.element_P[element.id]
-    V_2 = element_P[1]
-    V_3 = element_P[2]
-    M_2 = element_P[4]
-    M_3 = element_P[5]
-    graph = []
-    n = 8
-    magnifier = 0.05
-    graph.append(np.transpose(np.array([node_0.position])))
-    for i in range(0, n + 1):
-        x = i / n * element.L
-        point = np.array([
-            [i / n * element.L],
-            magnifier * (-M_3 + V_2 * x),
-            magnifier * (M_2 + V_3 * x)
-        ])
-        graph.append(np.transpose(np.array([node_0.position])) + np.transpose(T) @ point)
-    graph.append(np.transpose(np.array([node_1.position])))
-    return graph
-
-def get_deformed_shape(element, analysis):
-    node_0 = element.get_nodes()[0]
-    T = element.cosine_matrix
-    element_P = analysis.element_P[element.id]
-    element_D = analysis.element_D[element.id]
-    V_2 = element_P[1]
-    V_3 = element_P[2]
-    M_2 = element_P[4]
-    M_3 = element_P[5]
-    d0_0 = element_D[0]
-    d1_0 = element_D[1]
-    d2_0 = element_D[2]
-    d4_0 = element_D[4]
-    d5_0 = element_D[5]
-    d6_0 = element_D[6]
-    shape = []
-    n = 8
-    magnifier = 5
-    for i in range(0, n + 1):
-        x = i / n * element.L
-        d_i = np.array([
-            magnifier * d0_0 + i / n * (element.L + magnifier * (d6_0 - d0_0)),
-            # magnifier * (d1_0 + d5_0 * x + (-M_3 * x ** 2 / 2 + V_2 * x ** 3 / 6) / element.E / element.I3),
-            # magnifier * (d2_0 - d4_0 * x + (-M_2 * x ** 2 / 2 + V_3 * x ** 3 / 6) / element.E / element.I2)
-            magnifier * (d1_0 + d5_0 * x + (-M_3 * x ** 2 / 2 + V_2 * x ** 3 / 6) / element.E / element.I3),
-            magnifier * (d2_0 - d4_0 * x + (M_2 * x ** 2 / 2 + V_3 * x ** 3 / 6) / element.E / element.I2)
-        ])
-        shape.append(np.transpose(np.array([node_0.position])) + np.transpose(T) @ d_i)
-    return shape
-
-
-def plot(shapes, sight, color):
-    for shape in shapes:
-        projected_shape = [sight @ point for point in shape]
-        pyplot.plot(
-            np.array([point[0] for point in projected_shape]),
-            np.array([point[1] for point in projected_shape]),
-            color=color
-        )
+# Renders the Elements of each load (all load cases by default) as seen from each sight, without a display, into
+# <path>/<load name>_<sight name>.<format>. sights is a dict of names and 2x3 matrices, or a list named by index.
+# Given an executor, the (load, sight) pairs are split between its workers, each reusing a single figure, so that a
+# single load with several sights is also drawn in parallel. Returns the file paths.
+def export(analysis, path: str, sights, loads: list = None, format: str = 'png', elements=None,
+           samples: int = SAMPLES, executor=None, workers: int = None):
+    if not isinstance(sights, dict):
+        sights = {str(i): sight for i, sight in enumerate(sights)}
+    if loads is None:
+        loads = list(range(0, len(analysis.load_cases)))
+    ids = get_element_ids(analysis, elements)
+    geometry = get_geometry(analysis.model, ids)
+    os.makedirs(path, exist_ok=True)
+    load_arguments = []
+    for load in loads:
+        results = analysis.get_results(load)
+        load_arguments.append([results.name] + get_load_arguments(results, ids))
+    render = partial(render_loads, geometry, path=path, format=format, samples=samples)
+    executor = get_executor(executor, workers)
+    pairs = [(i, sight_name) for i in range(0, len(loads)) for sight_name in sights]
+    if executor is None or len(pairs) <= 1:
+        return render([arguments + [list(sights)] for arguments in load_arguments], sights)
+    chunks = [pairs[chunk] for chunk in get_chunks(len(pairs), -(-len(pairs) // (workers or os.cpu_count())))]
+    files = executor.map(
+        render,
+        [get_chunk_load_arguments(load_arguments, chunk) for chunk in chunks],
+        [{sight_name: sights[sight_name] for _, sight_name in chunk} for chunk in chunks]
+    )
+    return [file for chunk_files in files for file in chunk_files]
+
+
+# The load arguments of the loads in a chunk of (load, sight) pairs, each followed by the names of its sights
+def get_chunk_load_arguments(load_arguments: list, chunk: list):
+    sight_names = {}
+    for load, sight_name in chunk:
+        sight_names.setdefault(load, []).append(sight_name)
+    return [load_arguments[load] + [names] for load, names in sight_names.items()]
+
+
+def render_loads(geometry: list, load_arguments: list, sights: dict, path: str, format: str, samples: int = SAMPLES):
+    renderer = Renderer(geometry, sights, samples)
+    files = []
+    for name, element_P, element_D, sight_names in load_arguments:
+        files += renderer.render(name, element_P, element_D, path, format, sight_names)
+    return files
+
+
+# Draws on a single off-screen figure. The original shape of the Elements is projected once per sight and reused for
+# all loads.
+class Renderer:
+    def __init__(self, geometry: list, sights: dict, samples: int = SAMPLES):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        self.geometry = geometry
+        self.sights = sights
+        self.samples = samples
+        self.figure = Figure()
+        FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot()
+        original_shapes = get_original_shapes(geometry[0], geometry[1])
+        self.projections = {name: project(original_shapes, sight) for name, sight in sights.items()}
+
+    # Renders the load from the named sights, all of them by default
+    def render(self, name: str, element_P, element_D, path: str, format: str, sight_names: list = None):
+        graphs = get_graphs(*self.geometry, element_P, element_D, self.samples)[1:]
+        files = []
+        for sight_name in self.sights if sight_names is None else sight_names:
+            sight = self.sights[sight_name]
+            self.axes.clear()
+            plot(self.axes, self.projections[sight_name], None, COLORS[0])
+            for graph, color in zip(graphs, COLORS[1:]):
+                plot(self.axes, graph, sight, color)
+            self.axes.autoscale_view()
+            file = os.path.join(path, get_file_name(name) + '_' + get_file_name(sight_name) + '.' + format)
+            self.figure.savefig(file, format=format)
+            files.append(file)
+        return files
+
+
+def get_file_name(name: str):
+    return re.sub(r'[^\w.-]+', '_', str(name))
+
+
+def get_element_ids(analysis, elements):
+    if elements is None:
+        return np.arange(0, analysis.model.get_element_count())
+    return np.array([element.id for element in elements], dtype=int)
+
+
+# [positions of Node 0, positions of Node 1, cosine matrices, [L, A, I2, I3, J, E, G]] of the Elements of ids
+def get_geometry(model, ids):
+    connectivity = model.connectivity[ids]
+    return [
+        model.positions[connectivity[:, 0]],
+        model.positions[connectivity[:, 1]],
+        model.get_cosine_matrices(ids),
+        model.get_element_properties(ids)
+    ]
+
+
+def get_load_arguments(results, ids):
+    return [np.asarray(results.element_P)[ids, :, 0], np.asarray(results.element_D)[ids, :, 0]]
+
+
+def get_graphs(positions_0, positions_1, cosine_matrices, properties, element_P, element_D, samples: int = SAMPLES):
+    x = np.linspace(0, 1, samples + 1) * properties[:, 0:1]
+    return (
+        get_original_shapes(positions_0, positions_1),
+        get_shear_graphs(positions_0, positions_1, cosine_matrices, x, element_P),
+        get_moment_graphs(positions_0, positions_1, cosine_matrices, x, element_P),
+        get_deformed_shapes(positions_0, cosine_matrices, x, properties, element_P, element_D)
+    )
+
+
+def get_original_shapes(positions_0, positions_1):
+    return np.stack([positions_0, positions_1], axis=1)
+
+
+# Global positions of the points given in the local coordinates of each Element, [x, y, z] along the last axis
+def to_global(positions_0, cosine_matrices, points):
+    return positions_0[:, np.newaxis, :] + points @ cosine_matrices
+
+
+# Graphs start and end at the Nodes, so that they are closed by the Element.
+def close(positions_0, positions_1, graphs):
+    return np.concatenate([positions_0[:, np.newaxis, :], graphs, positions_1[:, np.newaxis, :]], axis=1)
+
+
+def get_shear_graphs(positions_0, positions_1, cosine_matrices, x, element_P):
+    V_2 = element_P[:, 1:2]
+    V_3 = element_P[:, 2:3]
+    points = np.stack([
+        x,
+        np.broadcast_to(SHEAR_MAGNIFIER * V_2, x.shape),
+        np.broadcast_to(SHEAR_MAGNIFIER * V_3, x.shape)
+    ], axis=2)
+    return close(positions_0, positions_1, to_global(positions_0, cosine_matrices, points))
+
+
+def get_moment_graphs(positions_0, positions_1, cosine_matrices, x, element_P):
+    V_2 = element_P[:, 1:2]
+    V_3 = element_P[:, 2:3]
+    M_2 = element_P[:, 4:5]
+    M_3 = element_P[:, 5:6]
+    points = np.stack([
+        x,
+        MOMENT_MAGNIFIER * (-M_3 + V_2 * x),
+        MOMENT_MAGNIFIER * (M_2 + V_3 * x)
+    ], axis=2)
+    return close(positions_0, positions_1, to_global(positions_0, cosine_matrices, points))
+
+
+def get_deformed_shapes(positions_0, cosine_matrices, x, properties, element_P, element_D):
+    L = properties[:, 0:1]
+    I2 = properties[:, 2:3]
+    I3 = properties[:, 3:4]
+    E = properties[:, 5:6]
+    V_2 = element_P[:, 1:2]
+    V_3 = element_P[:, 2:3]
+    M_2 = element_P[:, 4:5]
+    M_3 = element_P[:, 5:6]
+    d = [element_D[:, j:j + 1] for j in range(0, 12)]
+    magnifier = DEFORMATION_MAGNIFIER
+    points = np.stack([
+        magnifier * d[0] + x / L * (L + magnifier * (d[6] - d[0])),
+        magnifier * (d[1] + d[5] * x + (-M_3 * x ** 2 / 2 + V_2 * x ** 3 / 6) / E / I3),
+        magnifier * (d[2] - d[4] * x + (M_2 * x ** 2 / 2 + V_3 * x ** 3 / 6) / E / I2)
+    ], axis=2)
+    return to_global(positions_0, cosine_matrices, points)
+
+
+def project(shapes, sight):
+    return shapes @ np.transpose(np.asarray(sight, dtype=float))
+
+
+# Draws all shapes, each an array of points, as a single collection of lines. Shapes already projected are drawn as
+# they are when sight is None.
+def plot(axes, shapes, sight, color):
+    from matplotlib.collections import LineCollection
+    axes.add_collection(LineCollection(shapes if sight is None else project(shapes, sight), colors=color))